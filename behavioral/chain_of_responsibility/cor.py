@@ -31,7 +31,22 @@
 #    необработанными.
 
 
+import asyncio
+import codecs
+import copy
+import csv
+import json
+import mmap
+import os
+import tempfile
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import ExitStack, contextmanager
+from inspect import iscoroutinefunction, isgenerator
+from threading import Lock
+from time import perf_counter
+from xml.etree.ElementTree import iterparse
 
 
 class IParser(metaclass=ABCMeta):
@@ -44,65 +59,694 @@ class IParser(metaclass=ABCMeta):
     def parse(self, file):
         pass
 
+    @abstractmethod
+    def handle(self, file):
+        """ Обработка файла, который взял этот обработчик """
+        pass
+
+
+class IAsyncParser(metaclass=ABCMeta):
+    """ Интерфейс асинхронного обработчика """
+    @abstractmethod
+    async def parse(self, file):
+        pass
+
+
+ParseResult = namedtuple('ParseResult', ['file', 'result', 'error'])
+
+
+def _handle_file(parser, file):
+    """ Обработка одного файла в пуле (функция уровня модуля, чтобы её можно было передать в процесс).
+    Потоковый результат вычитывается здесь же, в исполнителе
+    """
+    result = parser.process(file)
+    return list(result) if isgenerator(result) else result
+
+
+def _parse_many(resolve, files, ordered):
+    """ Пакетная обработка: файлы группируются по обработчику, который их возьмёт, у каждого обработчика свой пул
+    размера parser.workers. Ошибка в одном файле (в том числе при выборе обработчика) попадает в его ParseResult
+    и не прерывает остальные
+    """
+    files = list(files)
+    entries = []
+    with ExitStack() as stack:
+        pools = {}
+        for file in files:
+            try:
+                parser = resolve(file)
+            except Exception as error:
+                entries.append(ParseResult(file, None, error))
+                continue
+            if parser is None:
+                entries.append(ParseResult(file, DefaultParser.unable_to_parse(file), None))
+                continue
+            if parser not in pools:
+                worker = parser
+                if parser.executor == 'process':
+                    # в процесс передаётся копия обработчика без остальной цепочки
+                    worker = copy.copy(parser)
+                    worker._next_parser = None
+                    pool = stack.enter_context(ProcessPoolExecutor(max_workers=parser.workers))
+                else:
+                    pool = stack.enter_context(ThreadPoolExecutor(max_workers=parser.workers))
+                pools[parser] = (pool, worker)
+            pool, worker = pools[parser]
+            entries.append(pool.submit(_handle_file, worker, file))
+
+        positions = {entry: i for i, entry in enumerate(entries) if isinstance(entry, Future)}
+        if ordered:
+            completed = entries
+        else:
+            ready = [entry for entry in entries if not isinstance(entry, Future)]
+            # as_completed отдаёт результаты по мере готовности, не дожидаясь всех файлов
+            completed = (entry for group in (ready, as_completed(positions)) for entry in group)
+
+        for entry in completed:
+            if not isinstance(entry, Future):
+                yield entry
+                continue
+            file = files[positions[entry]]
+            try:
+                yield ParseResult(file, entry.result(), None)
+            except Exception as error:
+                yield ParseResult(file, None, error)
+
+
+def _parser_stats(parsers):
+    return [{'parser': type(parser).__name__, 'extension': parser.extension, 'hits': parser.hits,
+             'misses': parser.misses, 'elapsed': parser.elapsed} for parser in parsers]
+
+
+class PrefixCache(object):
+    """ Кеш начальных байтов файлов для распознавания по содержимому. Начало файла читается один раз и
+    передаётся всем обработчикам цепочки. Запись действительна, пока не изменились время модификации
+    и размер файла, поэтому повторный проход по тем же файлам обходится одним вызовом stat
+    """
+    def __init__(self, prefix_size=4096, max_entries=10000):
+        self.prefix_size = prefix_size
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def read(self, file):
+        """ Начало файла или None, если файл недоступен """
+        try:
+            stat = os.stat(file)
+        except (OSError, TypeError, ValueError):
+            return None
+        stamp = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            entry = self._entries.get(file)
+            if entry and entry[0] == stamp:
+                self._entries.move_to_end(file)
+                return entry[1]
+
+        try:
+            with open(file, 'rb') as f:
+                prefix = f.read(self.prefix_size)
+        except OSError:
+            return None
+
+        with self._lock:
+            self._entries[file] = (stamp, prefix)
+            self._entries.move_to_end(file)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return prefix
+
 
 class DefaultParser(IParser):
-    """ Базовый класс обработчика """
-    def __init__(self):
+    """ Базовый класс обработчика. Конкретные обработчики объявляют расширение файлов extension и метод handle """
+    extension = None
+    executor = 'thread'  # пул для пакетной обработки: 'thread' для ввода-вывода, 'process' для тяжёлого разбора
+    workers = 4
+    concurrency = 100  # ограничение одновременных обработок в асинхронной цепочке
+    buffer_size = 1024 * 1024
+    prefix_cache = PrefixCache()  # общий для всех цепочек
+    _chain_version = 0  # меняется при любой перестройке цепочек, по нему скомпилированные цепочки узнают об изменениях
+
+    def __init__(self, use_mmap=False, encoding='utf-8'):
         self._next_parser = None
+        self.use_mmap = use_mmap
+        self.encoding = encoding
+        # статистика: сколько файлов обработчик взял, сколько раз проверял и отказывался, суммарное время обработки
+        self.hits = 0
+        self.misses = 0
+        self.elapsed = 0.0
+
+    @contextmanager
+    def open_source(self, file):
+        """ Источник байтов файла: буферизованный файл или отображение в память (у mmap те же read и readline) """
+        with open(file, 'rb', buffering=self.buffer_size) as f:
+            if not self.use_mmap or os.fstat(f.fileno()).st_size == 0:  # пустой файл отобразить нельзя
+                yield f
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as source:
+                yield source
+
+    def read_lines(self, source):
+        """ Построчное чтение источника с декодированием """
+        return (line.decode(self.encoding) for line in iter(source.readline, b''))
 
     def set_next(self, parser):
         self._next_parser = parser
+        DefaultParser._chain_version += 1
         # возврат обработчика для связи типа: json_parser.set_next(xml_parser).set_next(csv_parser)
         return parser
 
+    def compile(self):
+        """ Скомпилированная цепочка, начинающаяся с этого обработчика """
+        return CompiledChain(self)
+
     @staticmethod
     def can_parse(file, ext):
         if file:
-            extension = file.lower().split('.')[-1]
+            extension = os.fspath(file).lower().split('.')[-1]
             if extension == ext:
                 return True
         return False
 
-    def parse(self, file):
-        if self._next_parser:
-            return self._next_parser.parse(file)
+    @staticmethod
+    def file_extension(file):
+        return os.fspath(file).lower().split('.')[-1] if file else None
+
+    @staticmethod
+    def unable_to_parse(file):
         return f'Unable to find parser to file: {file}'
 
+    def accepts(self, file, extension):
+        """ Может ли обработчик взять файл. Расширение вычисляется один раз на файл и передаётся всем обработчикам """
+        return self.extension is not None and self.extension == extension
+
+    def sniff(self, prefix):
+        """ Распознавание файла по содержимому: prefix - начальные байты файла, общие для всей цепочки """
+        return False
+
+    def process(self, file):
+        """ Обработка файла с учётом времени. Для потокового результата учитывается время разбора каждой записи """
+        start = perf_counter()
+        result = self.handle(file)
+        self.elapsed += perf_counter() - start
+        return self._timed(result) if isgenerator(result) else result
+
+    def _timed(self, records):
+        while True:
+            start = perf_counter()
+            try:
+                record = next(records)
+            except StopIteration:
+                return
+            finally:
+                self.elapsed += perf_counter() - start
+            yield record
+
+    def stats(self):
+        """ Статистика обработчиков цепочки, начиная с этого """
+        return _parser_stats(self.chain())
+
+    def chain(self):
+        """ Обработчики цепочки, начиная с этого, без рекурсии """
+        parser = self
+        while parser is not None:
+            yield parser
+            parser = parser._next_parser
+
+    def resolve(self, file):
+        """ Обход цепочки циклом: глубина стека не зависит от длины цепочки. Возвращает первый подходящий
+        обработчик или None
+        """
+        extension = self.file_extension(file)
+        for parser in self.chain():
+            if parser.accepts(file, extension):
+                parser.hits += 1
+                return parser
+            parser.misses += 1
+        return self.resolve_by_content(file)
+
+    def resolve_by_content(self, file):
+        """ Если по расширению обработчик не нашёлся, файл предлагается обработчикам по содержимому.
+        Начало файла читается один раз (и кешируется) для всей цепочки
+        """
+        prefix = self.prefix_cache.read(file)
+        if prefix is None:
+            return None
+        for parser in self.chain():
+            if parser.sniff(prefix):
+                parser.hits += 1
+                return parser
+            parser.misses += 1
+        return None
 
-class JSONParser(DefaultParser):
-    """ Конкретный обработчик """
     def parse(self, file):
-        if self.can_parse(file, 'json'):
-            return f'JSON parser is parsing {file}...'
+        parser = self.resolve(file)
+        if parser is None:
+            return self.unable_to_parse(file)
+        return parser.process(file)
+
+    def parse_many(self, files, ordered=True):
+        """ Пакетная обработка файлов. Генератор ParseResult в порядке подачи (ordered=True) или завершения """
+        return _parse_many(self.resolve, files, ordered)
+
+    def parse_all(self, file):
+        """ Обработка с продолжением: файл получает каждый подходящий обработчик цепочки """
+        extension = self.file_extension(file)
+        results = [parser.process(file) for parser in self.chain() if parser.accepts(file, extension)]
+        if not results:
+            prefix = self.prefix_cache.read(file)
+            if prefix is not None:
+                results = [parser.process(file) for parser in self.chain() if parser.sniff(prefix)]
+        return results or [self.unable_to_parse(file)]
+
+
+class _TextPosition(object):
+    """ Положение начала текущего фрагмента в файле, чтобы ошибка разбора указывала место в файле, а не во фрагменте """
+    __slots__ = ('offset', 'line', 'column')
+
+    def __init__(self):
+        self.offset = 0
+        self.line = 1
+        self.column = 1
+
+    def advance(self, dropped):
+        """ Учёт текста, отброшенного из начала фрагмента """
+        self.offset += len(dropped)
+        newline = dropped.rfind('\n')
+        if newline < 0:
+            self.column += len(dropped)
         else:
-            return super().parse(file)
+            self.line += dropped.count('\n')
+            self.column = len(dropped) - newline
+
+    def error(self, msg, buf, pos):
+        error = json.JSONDecodeError(msg, buf, pos)
+        if error.lineno == 1:
+            error.colno += self.column - 1
+        error.lineno += self.line - 1
+        error.pos += self.offset
+        error.args = (f'{msg}: line {error.lineno} column {error.colno} (char {error.pos})',)
+        return error
+
+
+class JSONParser(DefaultParser):
+    """ Конкретный обработчик. Элементы массива верхнего уровня разбираются и отдаются по одному,
+    в памяти держится только текущий фрагмент файла. Прочие документы отдаются одной записью
+    """
+    extension = 'json'
+    chunk_size = 64 * 1024
+
+    def sniff(self, prefix):
+        """ Открывающая скобка и корректное начало содержимого: у объекта - ключ-строка, у массива - первый
+        элемент, за которым идёт разделитель. Строка журнала вида '[2024-01-01 10:00] ...' не подходит
+        """
+        text = prefix.decode(self.encoding, errors='ignore').lstrip('\ufeff \t\r\n')
+        if text[:1] not in ('{', '['):
+            return False
+        body = text[1:].lstrip()
+        if not body:
+            return True  # в префиксе только скобка
+        if text[0] == '{':
+            return body[0] in '"}'
+        if body[0] == ']':
+            return True
+        try:
+            _, end = json.JSONDecoder().raw_decode(body)
+        except ValueError:
+            # первый элемент мог не поместиться в префикс целиком, число или литерал - поместились бы
+            return body[0] in '"{['
+        rest = body[end:].lstrip()
+        return not rest or rest[0] in ',]'
+
+    def handle(self, file):
+        decoder = json.JSONDecoder()
+        text = codecs.getincrementaldecoder(self.encoding)()
+        with self.open_source(file) as source:
+            buf = ''
+            eof = False
+            while not eof and not buf.strip():
+                chunk = source.read(self.chunk_size)
+                eof = not chunk
+                buf += text.decode(chunk, final=eof)
+
+            start = len(buf) - len(buf.lstrip('\ufeff \t\r\n'))
+            if buf[start:start + 1] != '[':
+                yield json.loads(buf[start:] + text.decode(source.read(), final=True))
+                return
+
+            # ожидается: first - элемент или ']', item - элемент, separator - ',' или ']', end - только пробелы
+            where = _TextPosition()
+            expect = 'first'
+            pos = start + 1
+            while True:
+                while pos < len(buf) and buf[pos].isspace():
+                    pos += 1
+                if pos < len(buf):
+                    char = buf[pos]
+                    if expect == 'end':
+                        raise where.error('Extra data', buf, pos)
+                    if expect == 'separator':
+                        if char not in ',]':
+                            raise where.error("Expecting ',' delimiter", buf, pos)
+                        expect = 'item' if char == ',' else 'end'
+                        pos += 1
+                        continue
+                    if char == ']':
+                        if expect == 'item':
+                            raise where.error('Expecting value', buf, pos)
+                        expect = 'end'
+                        pos += 1
+                        continue
+                    try:
+                        item, end = decoder.raw_decode(buf, pos)
+                        # число на границе фрагмента могло оборваться: значение принимается, только если
+                        # за ним разделитель
+                        complete = eof or end < len(buf) and (buf[end] in ',]' or buf[end].isspace())
+                    except json.JSONDecodeError as error:
+                        if eof:
+                            raise where.error(error.msg, buf, error.pos) from None
+                        complete = False
+                    if complete:
+                        yield item
+                        expect = 'separator'
+                        pos = end
+                        continue
+                elif eof:
+                    if expect == 'end':
+                        return
+                    msg = "Expecting ',' delimiter" if expect == 'separator' else 'Expecting value'
+                    raise where.error(msg, buf, pos)
+
+                chunk = source.read(self.chunk_size)
+                eof = not chunk
+                where.advance(buf[:pos])
+                buf = buf[pos:] + text.decode(chunk, final=eof)
+                pos = 0
 
 
 class XMLParser(DefaultParser):
-    """ Конкретный обработчик """
-    def parse(self, file):
-        if self.can_parse(file, 'xml'):
-            return f'XML parser is parsing {file}...'
-        else:
-            return super().parse(file)
+    """ Конкретный обработчик. Разбор через iterparse: каждый дочерний элемент корня отдаётся записью (тег, поля),
+    где поля - атрибуты и тексты вложенных элементов, после чего элемент удаляется из дерева
+    """
+    extension = 'xml'
+
+    def sniff(self, prefix):
+        head = prefix.lstrip(codecs.BOM_UTF8 + b' \t\r\n')
+        return head.startswith(b'<?xml') or head[:1] == b'<' and head[1:2].isalpha()
+
+    def handle(self, file):
+        with self.open_source(file) as source:
+            depth = 0
+            root = None
+            for event, elem in iterparse(source, events=('start', 'end')):
+                if event == 'start':
+                    depth += 1
+                    if root is None:
+                        root = elem
+                    continue
+
+                depth -= 1
+                if depth == 1:
+                    record = dict(elem.attrib)
+                    record.update((child.tag, child.text) for child in elem)
+                    yield elem.tag, record
+                    root.clear()
 
 
 class CSVParser(DefaultParser):
-    """ Конкретный обработчик """
+    """ Конкретный обработчик. Строки читаются буферизованно и отдаются словарями по заголовку файла """
+    extension = 'csv'
+
+    def sniff(self, prefix):
+        """ Не меньше двух полных строк с одинаковым ненулевым числом запятых. Последняя строка может быть
+        оборвана, только если файл длиннее префикса
+        """
+        lines = prefix.decode(self.encoding, errors='ignore').splitlines()
+        if len(prefix) == self.prefix_cache.prefix_size:
+            lines = lines[:-1]
+        return len(lines) >= 2 and lines[0].count(',') > 0 and lines[0].count(',') == lines[1].count(',')
+
+    def handle(self, file):
+        with self.open_source(file) as source:
+            yield from csv.DictReader(self.read_lines(source))
+
+
+class CompiledChain(object):
+    """ Скомпилированная цепочка: индекс "расширение -> обработчик" строится один раз по связанным обработчикам,
+    и файл направляется нужному обработчику одним поиском в словаре вместо обхода цепочки.
+    При совпадении расширений побеждает обработчик, стоящий в цепочке раньше. Индекс перестраивается сам,
+    если после компиляции цепочка была изменена через set_next. Если в цепочке есть обработчик без extension
+    (со своей логикой выбора), используется обычный обход. Файлы с незнакомым расширением распознаются
+    по содержимому.
+    В адаптивном режиме (adaptive=True) каждые reorder_every файлов обработчики переставляются так, чтобы часто
+    срабатывающие стояли первыми: это сокращает обход для обработчиков без extension и распознавание
+    по содержимому. Перестановка выполняется, только если расширения обработчиков не пересекаются
+    (иначе порядок определял бы результат), и только в собственном списке скомпилированной цепочки:
+    связи самих обработчиков не меняются, и цепочка, с которой работают другие, остаётся прежней
+    """
+    def __init__(self, head, adaptive=False, reorder_every=1000):
+        self._head = head
+        self._parsers = []
+        self._index = None
+        self._version = None
+        self._reordered = False
+        self.adaptive = adaptive
+        self.reorder_every = reorder_every
+        self._since_reorder = 0
+
+    @property
+    def head(self):
+        return self._head
+
+    @property
+    def parsers(self):
+        """ Обработчики в порядке, в котором их опрашивает скомпилированная цепочка """
+        self._refresh()
+        return list(self._parsers)
+
+    def _compile(self):
+        parsers = []
+        parser = self._head
+        seen = set()
+        while parser is not None and id(parser) not in seen:
+            seen.add(id(parser))
+            parsers.append(parser)
+            parser = parser._next_parser
+        self._parsers = parsers
+        self._version = DefaultParser._chain_version
+        if self._reordered:
+            self._sort_by_hits()
+        self._build_index()
+
+    def _build_index(self):
+        index = {}
+        for parser in self._parsers:
+            if parser.extension is None:
+                index = None
+                break
+            index.setdefault(parser.extension, parser)
+        self._index = index
+
+    def _refresh(self):
+        if self._version != DefaultParser._chain_version:
+            self._compile()
+
+    def lookup(self, file):
+        """ Обработчик по индексу расширений, без обхода цепочки и чтения файла. None, если индекс не помог """
+        self._refresh()
+        if self._index is None:
+            return None
+        parser = self._index.get(DefaultParser.file_extension(file))
+        if parser is not None:
+            parser.hits += 1
+        return parser
+
+    def resolve(self, file):
+        if self.adaptive:
+            self._since_reorder += 1
+            if self._since_reorder >= self.reorder_every:
+                self.reorder()
+
+        parser = self.lookup(file)
+        if parser is not None:
+            return parser
+        if self._index is None:
+            extension = DefaultParser.file_extension(file)
+            for parser in self._parsers:
+                if parser.accepts(file, extension):
+                    parser.hits += 1
+                    return parser
+                parser.misses += 1
+        return self._resolve_by_content(file)
+
+    def _resolve_by_content(self, file):
+        prefix = DefaultParser.prefix_cache.read(file)
+        if prefix is None:
+            return None
+        for parser in self._parsers:
+            if parser.sniff(prefix):
+                parser.hits += 1
+                return parser
+            parser.misses += 1
+        return None
+
+    def _sort_by_hits(self):
+        """ Устойчивая сортировка по убыванию срабатываний. False, если расширения пересекаются """
+        extensions = [parser.extension for parser in self._parsers if parser.extension is not None]
+        if len(extensions) != len(set(extensions)):
+            return False
+        self._parsers.sort(key=lambda parser: parser.hits, reverse=True)
+        return True
+
+    def reorder(self):
+        """ Перестановка обработчиков по убыванию числа срабатываний """
+        self._since_reorder = 0
+        self._refresh()
+        if self._sort_by_hits():
+            self._reordered = True
+            self._build_index()
+
+    def stats(self):
+        self._refresh()
+        return _parser_stats(self._parsers)
+
     def parse(self, file):
-        if self.can_parse(file, 'csv'):
-            return f'CSV parser is parsing {file}...'
-        else:
-            return super().parse(file)
+        parser = self.resolve(file)
+        if parser is None:
+            return DefaultParser.unable_to_parse(file)
+        return parser.process(file)
+
+    def parse_many(self, files, ordered=True):
+        return _parse_many(self.resolve, files, ordered)
+
+
+class AsyncParserChain(IAsyncParser):
+    """ Асинхронная цепочка обработчиков для asyncio. В одной цепочке могут стоять обработчики с синхронным handle
+    и с handle-корутиной: корутины выполняются в цикле событий, синхронные обработчики (и распознавание файла
+    по содержимому, которому нужно читать файл) уходят в пул потоков и не блокируют цикл.
+    Число одновременных обработок каждым обработчиком ограничено его атрибутом concurrency
+    или значением из limits ({класс обработчика: предел})
+    """
+    def __init__(self, head, limits=None, max_threads=None):
+        self._chain = head if isinstance(head, CompiledChain) else CompiledChain(head)
+        self._limits = limits or {}
+        self._semaphores = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_threads)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def _semaphore(self, parser):
+        semaphore = self._semaphores.get(parser)
+        if semaphore is None:
+            limit = self._limits.get(type(parser), parser.concurrency)
+            semaphore = self._semaphores[parser] = asyncio.Semaphore(limit)
+        return semaphore
+
+    async def parse(self, file):
+        loop = asyncio.get_running_loop()
+        parser = self._chain.lookup(file)
+        if parser is None:
+            parser = await loop.run_in_executor(self._executor, self._chain.resolve, file)
+        if parser is None:
+            return DefaultParser.unable_to_parse(file)
+
+        async with self._semaphore(parser):
+            if iscoroutinefunction(parser.handle):
+                start = perf_counter()
+                try:
+                    return await parser.handle(file)
+                finally:
+                    parser.elapsed += perf_counter() - start
+            return await loop.run_in_executor(self._executor, _handle_file, parser, file)
+
+    async def parse_many(self, files):
+        """ Конкурентная обработка файлов, результаты - ParseResult в порядке подачи """
+        files = list(files)
+        results = await asyncio.gather(*(self.parse(file) for file in files), return_exceptions=True)
+        return [ParseResult(file, None, result) if isinstance(result, Exception) else ParseResult(file, result, None)
+                for file, result in zip(files, results)]
 
 
 if __name__ == '__main__':
+    tmp_dir = tempfile.mkdtemp()
+    samples = {
+        'file.xml': '<items><item id="1"><name>Apple</name></item><item id="2"><name>Pear</name></item></items>',
+        'file.txt': 'Just text',
+        'data.txt': '{"id": 3, "name": "Plum"}',
+        'file.csv': 'id,name\n1,Apple\n2,Pear\n',
+        'file.json': '[{"id": 1, "name": "Apple"}, {"id": 2, "name": "Pear"}]',
+    }
+    for name, content in samples.items():
+        with open(os.path.join(tmp_dir, name), 'w') as f:
+            f.write(content)
+    files = [os.path.join(tmp_dir, name) for name in samples]
+
+    def show(result):
+        print(result if isinstance(result, str) else list(result))
+
     json_parser = JSONParser()
-    xml_parser = XMLParser()
+    xml_parser = XMLParser(use_mmap=True)
     csv_parser = CSVParser()
 
     json_parser.set_next(xml_parser).set_next(csv_parser)
 
-    for file in ['file.xml', 'file.txt', 'file.csv', 'file.json']:
+    for file in files:
         result = json_parser.parse(file)
-        print(result)
+        show(result)
+
+    chain = json_parser.compile()
+    for file in files:
+        show(chain.parse(file))
+
+    json_parser.set_next(csv_parser)  # xml_parser выпадает из цепочки, индекс перестроится при следующем вызове
+    show(chain.parse(files[0]))
+    json_parser.set_next(xml_parser)
+
+    for item in chain.parse_many(files + ['missing.json']):
+        print(item)
+
+    adaptive_chain = CompiledChain(json_parser, adaptive=True, reorder_every=100)
+    for number in range(1000):
+        adaptive_chain.parse(files[3] if number % 10 else files[4])  # в основном CSV
+    for item in adaptive_chain.stats():
+        print(item)
+
+    class RemoteParser(DefaultParser):
+        """ Обработчик-корутина, например, обращение к внешнему сервису разбора """
+        extension = 'remote'
+        concurrency = 10
+
+        async def handle(self, file):
+            await asyncio.sleep(0.01)
+            return f'Remote parser has parsed {file}'
+
+    async def ingest():
+        remote_parser = RemoteParser()
+        remote_parser.set_next(JSONParser()).set_next(CSVParser())
+        async with AsyncParserChain(remote_parser) as async_chain:
+            print(await async_chain.parse('file.remote'))
+            results = await async_chain.parse_many([f'file{number}.remote' for number in range(100)] + files)
+            print(len(results), results[-2:])
+
+    asyncio.run(ingest())
+
+    class NumberedParser(DefaultParser):
+        def __init__(self, number):
+            super().__init__()
+            self.extension = f'ext{number}'
+
+        def handle(self, file):
+            return f'Parser #{self.extension[3:]} is parsing {file}...'
+
+    head = tail = NumberedParser(0)
+    for number in range(1, 10000):  # рекурсивный обход упёрся бы в RecursionError
+        tail = tail.set_next(NumberedParser(number))
+    print(head.parse('file.ext9999'))
+    print(head.parse_all('file.ext5000'))
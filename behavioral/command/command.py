@@ -20,7 +20,18 @@
 #    полученны через конструктор, или метод-сеттер.
 
 
+import os
+import pickle
+import struct
+import tempfile
+import weakref
 from abc import ABCMeta, abstractmethod
+from collections import deque
+from concurrent.futures import Future
+from itertools import count
+from queue import Full, Queue
+from threading import BrokenBarrierError, Barrier, Condition, Event, Lock, Thread, Timer
+from time import perf_counter
 
 
 class ICommand(metaclass=ABCMeta):
@@ -33,12 +44,29 @@ class ICommand(metaclass=ABCMeta):
     def undo(self):
         pass
 
+    # Необязательное описание команды для объединения (см. CommandCoalescer)
+    idempotent = False  # повторное выполнение не меняет результат
+    overwrites = False  # задаёт affects абсолютное значение, не зависящее от прежнего
+    inverse = None  # класс команды, которая, выполненная следом, в точности возвращает прежнее состояние
+
+    @property
+    def affects(self):
+        """ Что меняет команда (например, (получатель, свойство)). None - неизвестно """
+        return None
+
 
 class LightOnCommand(ICommand):
     """ Конкретная команда """
+    idempotent = True
+    overwrites = True
+
     def __init__(self, receiver):
         self.receiver = receiver
 
+    @property
+    def affects(self):
+        return self.receiver, 'power'
+
     def execute(self):
         self.receiver.on()
 
@@ -48,9 +76,16 @@ class LightOnCommand(ICommand):
 
 class LightOffCommand(ICommand):
     """ Конкретная команда """
+    idempotent = True
+    overwrites = True
+
     def __init__(self, receiver):
         self.receiver = receiver
 
+    @property
+    def affects(self):
+        return self.receiver, 'power'
+
     def execute(self):
         self.receiver.off()
 
@@ -58,33 +93,574 @@ class LightOffCommand(ICommand):
         self.receiver.on()
 
 
+class LightToggleCommand(ICommand):
+    """ Конкретная команда. Два переключения подряд возвращают свет в прежнее состояние """
+    def __init__(self, receiver):
+        self.receiver = receiver
+
+    @property
+    def affects(self):
+        return self.receiver, 'power'
+
+    def execute(self):
+        self.receiver.toggle()
+
+    def undo(self):
+        self.receiver.toggle()
+
+
+LightToggleCommand.inverse = LightToggleCommand
+
+
+class MacroCommand(ICommand):
+    """ Макрокоманда: группа команд, которая выполняется и отменяется как одно целое """
+    def __init__(self, commands):
+        self.commands = list(commands)
+
+    def execute(self):
+        for command in self.commands:
+            command.execute()
+
+    def undo(self):
+        for command in reversed(self.commands):
+            command.undo()
+
+
 class Light(object):
     """ Получатель команд """
     def __init__(self, place):
         self.place = place
+        self.is_on = False
 
     def on(self):
+        self.is_on = True
         print(f'Light in {self.place} is On')
 
     def off(self):
+        self.is_on = False
         print(f'Light in {self.place} is Off')
 
+    def toggle(self):
+        self.off() if self.is_on else self.on()
+
+
+class CommandHistory(object):
+    """ История команд ограниченной глубины. Стеки отмены и повтора - кольцевые буферы (deque с maxlen):
+    при переполнении самые старые команды вытесняются, и память не растёт с числом выполненных команд
+    """
+    def __init__(self, depth=100):
+        self._done = deque(maxlen=depth)
+        self._undone = deque(maxlen=depth)
+
+    def __len__(self):
+        return len(self._done)
+
+    @property
+    def last(self):
+        return self._done[-1] if self._done else None
+
+    def push(self, command):
+        """ Новая команда делает недоступным повтор отменённых """
+        self._done.append(command)
+        self._undone.clear()
+
+    def undo(self, steps=1):
+        """ Отмена steps последних команд, возвращает список отменённых """
+        undone = []
+        while len(undone) < steps and self._done:
+            command = self._done.pop()
+            command.undo()
+            self._undone.append(command)
+            undone.append(command)
+        return undone
+
+    def redo(self, steps=1):
+        """ Повтор steps последних отменённых команд, возвращает список повторённых """
+        redone = []
+        while len(redone) < steps and self._undone:
+            command = self._undone.pop()
+            command.execute()
+            self._done.append(command)
+            redone.append(command)
+        return redone
+
+
+class CommandJournal(object):
+    """ Журнал выполненных команд для восстановления состояния получателей после перезапуска.
+    Записи добавляются в конец файла в двоичном виде: 4 байта длины + запись. Запись хранит порядковый номер,
+    операцию (выполнение или отмена), класс команды и имя получателя в реестре receivers, поэтому команда
+    восстанавливается как Класс(получатель) без изменений интерфейса ICommand.
+    Групповая фиксация: фоновый поток сбрасывает на диск одним fsync все записи, накопившиеся к этому моменту
+    (не больше group_size), и сразу берётся за следующие. Отдельно группу не ждёт: пока идёт один fsync,
+    новые записи копятся и образуют следующую группу. Каждые snapshot_every записей состояние получателей сохраняется
+    в снимок, а журнал усекается, так что время восстановления остаётся ограниченным. Снимок хранит номер последней
+    учтённой в нём записи: если сбой случился между заменой снимка и усечением журнала, такие записи
+    при восстановлении пропускаются, а не применяются второй раз.
+    Снимок предполагает, что команды не выполняются параллельно с его созданием
+    """
+    EXECUTE = 'x'
+    UNDO = 'u'
+    HEADER = struct.Struct('>I')
+
+    def __init__(self, path, receivers, group_size=64, snapshot_every=10000):
+        self.path = path
+        self.snapshot_path = path + '.snapshot'
+        self.receivers = receivers
+        self._names = {id(receiver): name for name, receiver in receivers.items()}
+        self.group_size = group_size
+        self.snapshot_every = snapshot_every
+
+        self._seq = self._last_seq()  # номер последней записи, продолжает нумерацию после перезапуска
+        self._file = open(path, 'ab')
+        self._cond = Condition()
+        self._pending = []
+        self._appended = 0
+        self._durable = 0
+        self._since_snapshot = 0
+        self._closed = False
+        self._flusher = Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def _encode(self, command):
+        if isinstance(command, MacroCommand):
+            return MacroCommand, [self._encode(item) for item in command.commands]
+        name = self._names.get(id(getattr(command, 'receiver', None)))
+        if name is None:
+            raise ValueError(f'{type(command).__name__}: receiver is not registered in the journal')
+        return type(command), name
+
+    def check(self, command):
+        """ Проверка, что команду можно записать в журнал (все её получатели есть в реестре receivers) """
+        self._encode(command)
+
+    def _decode(self, encoded):
+        command_class, arg = encoded
+        if command_class is MacroCommand:
+            return MacroCommand([self._decode(item) for item in arg])
+        return command_class(self.receivers[arg])
+
+    def _load_snapshot(self):
+        """ Номер последней учтённой записи и состояние получателей из снимка, (0, {}) - если снимка нет """
+        if not os.path.exists(self.snapshot_path):
+            return 0, {}
+        with open(self.snapshot_path, 'rb') as f:
+            snapshot = pickle.load(f)
+        return snapshot['seq'], snapshot['state']
+
+    def _records(self, f):
+        """ Целые записи журнала: (конец записи в файле, номер, операция, команда в виде _encode).
+        Останавливается на оборванной или испорченной записи
+        """
+        while True:
+            header = f.read(self.HEADER.size)
+            if len(header) < self.HEADER.size:
+                return
+            size, = self.HEADER.unpack(header)
+            payload = f.read(size)
+            if len(payload) < size:
+                return
+            try:
+                seq, operation, encoded = pickle.loads(payload)
+            except Exception:
+                return
+            yield f.tell(), seq, operation, encoded
+
+    def _last_seq(self):
+        seq, _ = self._load_snapshot()
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                for _, seq, _, _ in self._records(f):
+                    pass
+        return seq
+
+    def append(self, operation, command, wait=True):
+        """ Добавление записи. При wait=True возвращается только после того, как запись попала на диск """
+        encoded = self._encode(command)
+        with self._cond:
+            if self._closed:
+                raise ValueError('Journal is closed')
+            self._seq += 1
+            payload = pickle.dumps((self._seq, operation, encoded), protocol=pickle.HIGHEST_PROTOCOL)
+            self._pending.append(self.HEADER.pack(len(payload)) + payload)
+            self._appended += 1
+            number = self._appended
+            self._cond.notify_all()
+            if wait:
+                self._cond.wait_for(lambda: self._durable >= number)
+            self._since_snapshot += 1
+            need_snapshot = self._since_snapshot >= self.snapshot_every
+        if need_snapshot:
+            self.snapshot()
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return
+                # группу составляют записи, поступившие во время предыдущего fsync
+                batch, self._pending = self._pending[:self.group_size], self._pending[self.group_size:]
+            self._write(batch)
+            with self._cond:
+                self._durable += len(batch)
+                self._cond.notify_all()
+
+    def _write(self, batch):
+        self._file.write(b''.join(batch))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def sync(self):
+        """ Ожидание, пока все добавленные записи попадут на диск """
+        with self._cond:
+            self._cond.wait_for(lambda: self._durable >= self._appended)
+
+    def snapshot(self):
+        """ Снимок состояния получателей (вместе с номером последней учтённой записи) и усечение журнала """
+        with self._cond:
+            self._cond.wait_for(lambda: self._durable >= self._appended)
+            state = {name: vars(receiver) for name, receiver in self.receivers.items()}
+            tmp_path = self.snapshot_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'seq': self._seq, 'state': state}, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            self._file.truncate(0)
+            os.fsync(self._file.fileno())
+            self._since_snapshot = 0
+
+    def replay(self):
+        """ Восстановление состояния: снимок, затем потоковое применение записей журнала, которых нет в снимке.
+        Оборванная последняя запись (сбой во время записи) отрезается от файла, чтобы новые записи не оказались
+        за ней. Возвращает число применённых записей
+        """
+        covered, state = self._load_snapshot()
+        for name, values in state.items():
+            vars(self.receivers[name]).update(values)
+
+        applied = 0
+        good = 0  # конец последней целой записи
+        with open(self.path, 'rb') as f:
+            for good, seq, operation, encoded in self._records(f):
+                if seq <= covered:
+                    continue  # запись уже учтена в снимке, журнал не успели усечь
+                command = self._decode(encoded)
+                if operation == self.EXECUTE:
+                    command.execute()
+                else:
+                    command.undo()
+                applied += 1
+            torn = f.seek(0, os.SEEK_END) > good
+
+        if torn:
+            with self._cond:
+                self._cond.wait_for(lambda: self._durable >= self._appended)
+                self._file.truncate(good)
+                os.fsync(self._file.fileno())
+        return applied
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._flusher.join()
+        self._file.close()
+
 
 class RemoteControl(object):
-    """ Отправитель команд """
-    def __init__(self):
+    """ Отправитель команд. С журналом при durable=True каждое нажатие возвращается после записи на диск;
+    при durable=False записи нажатий подряд сбрасываются общим fsync, а долговечность обеспечивает sync()
+    """
+    def __init__(self, history_depth=100, journal=None, durable=True):
         self.command = None
-        self.undo_command = None
+        self.history = CommandHistory(history_depth)
+        self.journal = journal
+        self.durable = durable
+
+    @property
+    def undo_command(self):
+        return self.history.last
 
     def set_command(self, command):
         self.command = command
 
     def press_button(self):
+        if self.journal:
+            self.journal.check(self.command)  # до выполнения, чтобы состояние, история и журнал не разошлись
         self.command.execute()
-        self.undo_command = self.command
+        self.history.push(self.command)
+        if self.journal:
+            self.journal.append(CommandJournal.EXECUTE, self.command, self.durable)
+
+    def sync(self):
+        """ Ожидание, пока все нажатия попадут в журнал на диске """
+        if self.journal:
+            self.journal.sync()
+
+    def undo(self, steps=1):
+        undone = self.history.undo(steps)
+        if self.journal:
+            for command in undone:
+                self.journal.append(CommandJournal.UNDO, command, self.durable)
+        return undone
+
+    def redo(self, steps=1):
+        redone = self.history.redo(steps)
+        if self.journal:
+            for command in redone:
+                self.journal.append(CommandJournal.EXECUTE, command, self.durable)
+        return redone
+
+
+class CommandCoalescer(object):
+    """ Объединение команд перед выполнением. Команды копятся в окне (window секунд или max_size команд),
+    затем передаются RemoteControl. Пока команды ждут в окне:
+     - команда, задающая объекту абсолютное значение (overwrites, например LightOffCommand), вытесняет все
+     ожидающие команды над тем же объектом: выполнится только последняя;
+     - команда, обратная последней ожидающей команде над тем же объектом (второй LightToggleCommand),
+     взаимно уничтожается с ней;
+     - повтор идемпотентной команды над тем же объектом отбрасывается.
+    Объединяются только команды, объявившие affects. Команда без affects может затронуть что угодно,
+    поэтому служит границей: команды до неё и после неё не объединяются
+    """
+    def __init__(self, remote, window=0.01, max_size=100):
+        self.remote = remote
+        self.window = window
+        self.max_size = max_size
+        self._pending = {}  # номер -> команда, в порядке поступления
+        self._targets = {}  # объект -> стек номеров ожидающих команд над ним
+        self._sequence = count()
+        self._lock = Lock()
+        self._execute_lock = Lock()  # пачки выполняются строго по очереди
+        self._timer = None
+        self.stats = {'submitted': 0, 'cancelled': 0, 'collapsed': 0, 'overwritten': 0, 'executed': 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def submit(self, command):
+        with self._lock:
+            self.stats['submitted'] += 1
+            self._add(command)
+            full = len(self._pending) >= self.max_size
+            if not full and self._pending and self._timer is None:
+                self._timer = Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def _add(self, command):
+        target = command.affects
+        if target is None:
+            self._targets.clear()
+            self._pending[next(self._sequence)] = command
+            return
+
+        stack = self._targets.setdefault(target, [])
+        last = self._pending[stack[-1]] if stack else None
+        if last is not None and command.idempotent and type(command) is type(last):
+            self.stats['collapsed'] += 1
+        elif command.overwrites:
+            for number in stack:
+                del self._pending[number]
+            self.stats['overwritten'] += len(stack)
+            stack.clear()
+            number = next(self._sequence)
+            self._pending[number] = command
+            stack.append(number)
+        elif last is not None and last.inverse is not None and isinstance(command, last.inverse):
+            del self._pending[stack.pop()]
+            self.stats['cancelled'] += 2
+        else:
+            number = next(self._sequence)
+            self._pending[number] = command
+            stack.append(number)
+
+    def _take(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch = list(self._pending.values())
+        self._pending.clear()
+        self._targets.clear()
+        return batch
+
+    def flush(self):
+        """ Выполнение всех ожидающих команд """
+        with self._execute_lock:
+            with self._lock:
+                batch = self._take()
+            for command in batch:
+                self.remote.set_command(command)
+                self.remote.press_button()
+            with self._lock:
+                self.stats['executed'] += len(batch)
+
+
+class _Gate(object):
+    """ Точка синхронизации макрокоманды, затрагивающей получателей из нескольких очередей шины: команда
+    выполняется, когда все эти очереди дошли до неё, а остальные исполнители ждут её завершения
+    """
+    def __init__(self, parties):
+        self.barrier = Barrier(parties)
+        self.done = Event()
 
-    def undo(self):
-        self.undo_command.undo()
+
+class CommandBus(object):
+    """ Шина команд: команды принимаются в ограниченные очереди и выполняются пулом потоков-исполнителей,
+    вызывающий получает Future. Команды одного получателя попадают в одну очередь и выполняются строго по порядку,
+    команды разных получателей - параллельно. Новый получатель закрепляется за очередью с наименьшим числом
+    получателей и освобождает место, когда собран сборщиком мусора. Макрокоманда над получателями из разных
+    очередей ставится во все эти очереди и выполняется, когда каждая из них до неё дошла, поэтому порядок
+    по каждому получателю сохраняется.
+    Если очередь заполнена, submit ждёт (block=True, с timeout) или сразу выбрасывает queue.Full - так нагрузка
+    сдерживается на стороне отправителя
+    """
+    def __init__(self, workers=4, queue_size=1000):
+        self._queues = [Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = [Thread(target=self._work, args=(q,), daemon=True) for q in self._queues]
+        self._round_robin = count()
+        self._lock = Lock()
+        self._assigned = {}  # id получателя -> номер очереди
+        self._load = [0] * workers  # число получателей, закреплённых за каждой очередью
+        self._released = deque()  # id собранных получателей, их места освобождаются при следующем закреплении
+        self._submit_lock = Lock()  # макрокоманды встают во все свои очереди в одном и том же порядке
+        self._executed = 0
+        self._failed = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._wait_total = 0.0
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    @classmethod
+    def receivers_of(cls, command):
+        """ Получатели команды, для макрокоманды - получатели всех вложенных команд """
+        if isinstance(command, MacroCommand):
+            return [receiver for item in command.commands for receiver in cls.receivers_of(item)]
+        receiver = getattr(command, 'receiver', None)
+        return [] if receiver is None else [receiver]
+
+    def _release(self, key):
+        # вызывается сборщиком мусора в любом потоке, поэтому без блокировки: только добавление в deque
+        self._released.append(key)
+
+    def _queue_of(self, receiver):
+        """ Номер очереди получателя. Вызывается под self._lock """
+        while self._released:
+            self._load[self._assigned.pop(self._released.popleft())] -= 1
+        key = id(receiver)
+        index = self._assigned.get(key)
+        if index is None:
+            try:
+                weakref.finalize(receiver, self._release, key).atexit = False
+            except TypeError:  # без слабых ссылок получателя не отследить - очередь по перемешанному хешу
+                return (hash(receiver) * 0x9E3779B97F4A7C15 >> 32) % len(self._queues)
+            index = self._assigned[key] = self._load.index(min(self._load))
+            self._load[index] += 1
+        return index
+
+    def _queues_for(self, command):
+        receivers = self.receivers_of(command)
+        if not receivers:
+            return [self._queues[next(self._round_robin) % len(self._queues)]]
+        with self._lock:
+            indexes = {self._queue_of(receiver): None for receiver in receivers}
+        return [self._queues[index] for index in indexes]
+
+    def submit(self, command, block=True, timeout=None):
+        future = Future()
+        queues = self._queues_for(command)
+        enqueued = perf_counter()
+        try:
+            if len(queues) == 1:
+                queues[0].put((future, command, enqueued, None), block, timeout)
+                return future
+            gate = _Gate(len(queues))
+            with self._submit_lock:
+                try:
+                    queues[0].put((future, command, enqueued, gate), block, timeout)
+                    for queue in queues[1:]:
+                        queue.put((None, None, enqueued, gate), block, timeout)
+                except Full:
+                    gate.barrier.abort()  # уже поставленные части пропускаются исполнителями
+                    raise
+            return future
+        except Full:
+            raise Full(f'Command queue is full, {type(command).__name__} rejected')
+
+    def _work(self, queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            future, command, enqueued, gate = item
+            if gate is not None:
+                try:
+                    gate.barrier.wait()  # все очереди макрокоманды дошли до неё
+                except BrokenBarrierError:
+                    continue
+                if future is None:
+                    gate.done.wait()  # очередь стоит, пока макрокоманда выполняется в другом исполнителе
+                    continue
+            if not future.set_running_or_notify_cancel():
+                if gate is not None:
+                    gate.done.set()
+                continue
+
+            start = perf_counter()
+            try:
+                command.execute()
+            except Exception as error:
+                future.set_exception(error)
+                failed = True
+            else:
+                future.set_result(command)
+                failed = False
+            if gate is not None:
+                gate.done.set()
+            latency = perf_counter() - start
+
+            with self._lock:
+                self._executed += 1
+                self._failed += failed
+                self._latency_total += latency
+                self._latency_max = max(self._latency_max, latency)
+                self._wait_total += start - enqueued
+
+    def metrics(self):
+        """ Глубина очередей и время выполнения команд (в секундах) """
+        with self._lock:
+            executed = self._executed
+            return {
+                'queue_depth': sum(q.qsize() for q in self._queues),
+                'queue_depths': [q.qsize() for q in self._queues],
+                'receivers': list(self._load),
+                'executed': executed,
+                'failed': self._failed,
+                'avg_latency': self._latency_total / executed if executed else 0.0,
+                'max_latency': self._latency_max,
+                'avg_wait': self._wait_total / executed if executed else 0.0,
+            }
+
+    def shutdown(self, wait=True):
+        """ Остановка после выполнения уже принятых команд """
+        for q in self._queues:
+            q.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
 
 
 if __name__ == '__main__':
@@ -98,3 +674,54 @@ if __name__ == '__main__':
     remote.set_command(LightOffCommand(light))
     remote.press_button()
     remote.undo()
+
+    kitchen = Light('kitchen')
+    remote.set_command(MacroCommand([LightOnCommand(light), LightOnCommand(kitchen)]))
+    remote.press_button()
+    remote.set_command(LightOffCommand(kitchen))
+    remote.press_button()
+    print('--- undo 2 steps ---')
+    remote.undo(2)
+    print('--- redo 1 step ---')
+    remote.redo()
+
+    print('--- command bus ---')
+    with CommandBus(workers=2, queue_size=10) as bus:
+        futures = [bus.submit(command_class(room))
+                   for room in (light, kitchen) for command_class in (LightOnCommand, LightOffCommand)]
+        futures.append(bus.submit(MacroCommand([LightOffCommand(light), LightOffCommand(kitchen)])))
+        for future in futures:
+            future.result()
+        print(bus.metrics())
+
+    rooms = [Light(f'room {number}') for number in range(4)]
+    with CommandBus(workers=4) as bus:
+        for future in [bus.submit(LightOnCommand(room)) for room in rooms]:
+            future.result()
+        print(f"Receivers per queue: {bus.metrics()['receivers']}")  # разные получатели - в разных очередях
+
+    print('--- coalescing ---')
+    with CommandCoalescer(RemoteControl()) as coalescer:
+        for command in (LightOnCommand(light), LightOffCommand(light), LightOnCommand(light), LightOnCommand(light),
+                        LightToggleCommand(kitchen), LightToggleCommand(kitchen), LightOffCommand(kitchen)):
+            coalescer.submit(command)
+    print(coalescer.stats)
+
+    print('--- command journal ---')
+    journal_path = os.path.join(tempfile.mkdtemp(), 'commands.log')
+    receivers = {'living room': light, 'kitchen': kitchen}
+    journal = CommandJournal(journal_path, receivers, snapshot_every=3)
+    remote = RemoteControl(journal=journal, durable=False)
+    for command in (LightOnCommand(light), LightOffCommand(kitchen), LightOffCommand(light), LightOnCommand(kitchen)):
+        remote.set_command(command)
+        remote.press_button()
+    remote.undo()
+    remote.sync()  # нажатия выше сброшены на диск общими fsync
+    journal.close()
+
+    print('--- restart and replay ---')
+    restored = {'living room': Light('living room'), 'kitchen': Light('kitchen')}
+    journal = CommandJournal(journal_path, restored)
+    print(f'Replayed {journal.replay()} records')
+    print({name: receiver.is_on for name, receiver in restored.items()})
+    journal.close()
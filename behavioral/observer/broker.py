@@ -0,0 +1,305 @@
+# Брокер новостей для нескольких процессов.
+#    Процесс-брокер держит NewsFeed и обслуживает subscribe/unsubscribe/add_news по Unix domain socket.
+#    Клиенты в других процессах подключаются через BrokerClient: подписывают своих читателей и получают
+#    вызовы update (update_batch для пачки), как если бы NewsFeed был локальным.
+#    Кадр протокола: заголовок struct '>BI' (код операции, длина данных) и данные. Строки в данных - UTF-8 с
+#    префиксом длины '>I'. Публикации не подтверждаются (конвейер), клиент копит их и отправляет пачками.
+# Использование:
+#    python broker.py /tmp/news.sock          - запустить брокер
+#    python broker.py                         - демонстрация: брокер, издатель и читатель в разных процессах
+
+
+import asyncio
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import Process
+
+from observer import NewsFeed, Reader
+
+HEADER = struct.Struct('>BI')
+LENGTH = struct.Struct('>I')
+
+SUBSCRIBE, UNSUBSCRIBE, PUBLISH_BATCH, DELIVER, PING, PONG = range(1, 7)
+
+
+def pack_strings(*strings):
+    parts = []
+    for string in strings:
+        data = string.encode('utf-8')
+        parts.append(LENGTH.pack(len(data)))
+        parts.append(data)
+    return b''.join(parts)
+
+
+def unpack_strings(payload, offset=0):
+    strings = []
+    while offset < len(payload):
+        size, = LENGTH.unpack_from(payload, offset)
+        offset += LENGTH.size
+        strings.append(payload[offset:offset + size].decode('utf-8'))
+        offset += size
+    return strings
+
+
+def frame(op, payload=b''):
+    return HEADER.pack(op, len(payload)) + payload
+
+
+class RemoteReader(object):
+    """ Читатель на стороне брокера: представляет одного читателя клиента (со всеми его подписками) и пересылает
+    ему новости кадром DELIVER. Как и у локального NewsFeed, новость, подходящая под несколько подписок одного
+    читателя, доставляется ему один раз.
+    Соединение, в которое что-то записано, попадает в touched - брокер дожидается его опустошения
+    """
+    def __init__(self, writer, rid, name, touched):
+        self.writer = writer
+        self.rid = rid
+        self.name = name
+        self.touched = touched
+
+    def update(self, msg):
+        self.update_batch([msg])
+
+    def update_batch(self, msgs):
+        if self.writer.is_closing():
+            return
+        self.writer.write(frame(DELIVER, LENGTH.pack(self.rid) + pack_strings(*msgs)))
+        self.touched.add(self.writer)
+
+
+class NewsBroker(object):
+    """ Процесс-брокер. Все подключения обслуживаются одним циклом событий, поэтому NewsFeed используется
+    без блокировок, а кадры одного клиента обрабатываются строго по порядку.
+    После каждой пачки публикаций брокер ждёт, пока подписчики заберут разосланное, поэтому издатель не может
+    обогнать читателей. Подписчик, у которого в буфере отправки скопилось больше max_buffer байт, отключается
+    """
+    def __init__(self, path, history=100, max_buffer=1 << 20):
+        self.path = path
+        self.feed = NewsFeed(history)
+        self.max_buffer = max_buffer
+        self.clients = 0
+        self._touched = set()  # соединения подписчиков, в которые писали с последнего ожидания
+
+    async def _drain_subscribers(self):
+        writers = list(self._touched)
+        self._touched.clear()
+        for writer in writers:
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                print('NewsBroker: subscriber is too slow, disconnecting')
+                writer.close()
+        await asyncio.gather(*(writer.drain() for writer in writers if not writer.is_closing()),
+                             return_exceptions=True)
+
+    async def _serve_client(self, stream, writer):
+        self.clients += 1
+        name = f'client-{self.clients}'
+        readers = {}  # номер читателя клиента -> RemoteReader
+        subscriptions = {}  # sid -> подписка NewsFeed
+        try:
+            while True:
+                op, size = HEADER.unpack(await stream.readexactly(HEADER.size))
+                payload = await stream.readexactly(size)
+                if op == PUBLISH_BATCH:
+                    strings = unpack_strings(payload)
+                    self.feed.add_news_batch(zip(strings[::2], strings[1::2]))
+                    await self._drain_subscribers()
+                elif op == SUBSCRIBE:
+                    sid, = LENGTH.unpack_from(payload)
+                    rid, = LENGTH.unpack_from(payload, LENGTH.size)
+                    topic, = unpack_strings(payload, 2 * LENGTH.size)
+                    reader = readers.get(rid)
+                    if reader is None:
+                        reader = readers[rid] = RemoteReader(writer, rid, f'{name}/{rid}', self._touched)
+                    subscriptions[sid] = self.feed.subscribe(topic, reader)
+                elif op == UNSUBSCRIBE:
+                    sid, = LENGTH.unpack(payload)
+                    subscription = subscriptions.pop(sid, None)
+                    if subscription is not None:
+                        subscription.unsubscribe()
+                elif op == PING:
+                    writer.write(frame(PONG, payload))
+                else:
+                    print(f'NewsBroker: unknown operation {op} from {name}')
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for subscription in subscriptions.values():
+                subscription.unsubscribe()
+            writer.close()
+
+    async def serve(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self._serve_client, self.path)
+        print(f'NewsBroker: listening on {self.path}')
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+
+class BrokerClient(object):
+    """ Клиентская заглушка NewsFeed. Публикации копятся в буфере и уходят одним кадром PUBLISH_BATCH по
+    batch_size штук или по flush(); ответа брокера они не ждут. Новости для подписанных читателей принимает
+    фоновый поток и вызывает у них update (или update_batch, если пришло несколько новостей сразу)
+    """
+    def __init__(self, path, batch_size=64, timeout=5.0):
+        self.batch_size = batch_size
+        self._socket = self._connect(path, timeout)
+        self._send_lock = threading.Lock()
+        self._buffer = []
+        self._readers = {}  # номер читателя -> читатель
+        self._rids = {}  # id читателя -> номер читателя
+        self._subscriptions = {}  # sid -> номер читателя
+        self._refs = {}  # номер читателя -> число его подписок
+        self._next_sid = 0
+        self._pongs = {}
+        self._receiver = threading.Thread(target=self._receive, daemon=True)
+        self._receiver.start()
+
+    @staticmethod
+    def _connect(path, timeout):
+        """ Брокер может ещё запускаться, поэтому подключение повторяется до timeout """
+        deadline = time.monotonic() + timeout
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(path)
+                return sock
+            except (FileNotFoundError, ConnectionRefusedError):
+                sock.close()
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def _send(self, data):
+        with self._send_lock:
+            self._socket.sendall(data)
+
+    def _recv_exactly(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self._socket.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('broker closed the connection')
+            data += chunk
+        return bytes(data)
+
+    def _receive(self):
+        try:
+            while True:
+                op, size = HEADER.unpack(self._recv_exactly(HEADER.size))
+                payload = self._recv_exactly(size)
+                if op == DELIVER:
+                    rid, = LENGTH.unpack_from(payload)
+                    reader = self._readers.get(rid)
+                    if reader is not None:
+                        try:
+                            self._dispatch(reader, unpack_strings(payload, LENGTH.size))
+                        except Exception as error:  # ошибка читателя не должна останавливать приём
+                            print(f'BrokerClient: {reader.name} failed to handle news: {error!r}')
+                elif op == PONG:
+                    self._pongs.pop(payload).set()
+        except (ConnectionError, OSError):
+            pass
+
+    @staticmethod
+    def _dispatch(reader, titles):
+        update_batch = getattr(reader, 'update_batch', None)
+        if update_batch is not None and len(titles) > 1:
+            update_batch(titles)
+        else:
+            for title in titles:
+                reader.update(title)
+
+    def subscribe(self, news_type, reader):
+        """ Возвращает номер подписки для unsubscribe. Все подписки одного читателя брокер ведёт как одного
+        читателя, поэтому новость, подходящая под несколько его подписок, приходит один раз
+        """
+        self.flush()
+        self._next_sid += 1
+        sid = self._next_sid
+        rid = self._rids.get(id(reader))
+        if rid is None:
+            rid = self._rids[id(reader)] = sid
+            self._readers[rid] = reader
+        self._subscriptions[sid] = rid
+        self._refs[rid] = self._refs.get(rid, 0) + 1
+        self._send(frame(SUBSCRIBE, LENGTH.pack(sid) + LENGTH.pack(rid) + pack_strings(news_type)))
+        return sid
+
+    def unsubscribe(self, sid):
+        self.flush()
+        self._send(frame(UNSUBSCRIBE, LENGTH.pack(sid)))
+        rid = self._subscriptions.pop(sid, None)
+        if rid is None:
+            return
+        self._refs[rid] -= 1
+        if not self._refs[rid]:
+            del self._refs[rid]
+            del self._rids[id(self._readers.pop(rid))]
+
+    def add_news(self, news_type, title):
+        self._buffer.append(news_type)
+        self._buffer.append(title)
+        if len(self._buffer) >= 2 * self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            batch, self._buffer = self._buffer, []
+            self._send(frame(PUBLISH_BATCH, pack_strings(*batch)))
+
+    def sync(self, timeout=5.0):
+        """ Ожидание, пока брокер обработает всё отправленное этим клиентом """
+        self.flush()
+        token = os.urandom(8)
+        event = self._pongs[token] = threading.Event()
+        self._send(frame(PING, token))
+        if not event.wait(timeout):
+            raise TimeoutError('broker did not answer')
+
+    def close(self):
+        self.flush()
+        self._socket.shutdown(socket.SHUT_RDWR)
+        self._socket.close()
+        self._receiver.join()
+
+
+def publisher(path):
+    client = BrokerClient(path, batch_size=3)
+    for number in range(5):
+        client.add_news('sport.chess', f'Round {number}')
+    client.add_news('music', 'Music article')
+    client.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        NewsBroker(sys.argv[1]).run()
+        sys.exit()
+
+    path = os.path.join(tempfile.mkdtemp(), 'news.sock')
+    broker = Process(target=NewsBroker(path).run, daemon=True)
+    broker.start()
+
+    john = Reader('John')
+    client = BrokerClient(path)
+    client.subscribe('sport.#', john)
+    client.sync()  # подписка зарегистрирована до публикаций
+
+    writer = Process(target=publisher, args=(path,))
+    writer.start()
+    writer.join()
+    time.sleep(0.2)  # новости от издателя доходят до читателя
+
+    client.close()
+    broker.terminate()
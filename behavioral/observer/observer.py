@@ -14,7 +14,16 @@
 #    5. Клиент должен создавать необходимое количество объектов подписчиков и подписывать их у издателей.
 
 
+import asyncio
+import gc
+import heapq
+import re
+import threading
+import time
+import weakref
+from array import array
 from abc import ABCMeta, abstractmethod
+from inspect import iscoroutinefunction
 
 
 class IReader(metaclass=ABCMeta):
@@ -33,6 +42,10 @@ class Reader(IReader):
     def update(self, msg):
         print(f'New article for {self.name}: {msg}')
 
+    def update_batch(self, msgs):
+        """ Пачка новостей за один вызов. Подписчики без этого метода получают новости по одной через update """
+        print(f'{len(msgs)} new articles for {self.name}: {", ".join(msgs)}')
+
 
 class INewsFeed(metaclass=ABCMeta):
     """ Абстрактный класс издателя """
@@ -52,32 +65,748 @@ class INewsFeed(metaclass=ABCMeta):
         pass
 
 
-class NewsFeed(INewsFeed):
-    """ Конкретный класс издателя """
+WORD = re.compile(r'\w+')
+
+
+def title_words(title):
+    return set(WORD.findall(title.lower()))
+
+
+class NewsFilter(object):
+    """ Декларативный фильтр подписки по содержимому новости. Новость подходит, если выполнены все заданные условия:
+     - keywords - в заголовке есть хотя бы одно из слов (без учёта регистра);
+     - prefix - заголовок начинается с prefix (без учёта регистра);
+     - fields - метаданные новости (meta в add_news) содержат все эти пары поле-значение
+    """
+    __slots__ = ('keywords', 'prefix', 'fields')
+
+    def __init__(self, keywords=None, prefix=None, fields=None):
+        self.keywords = frozenset(word.lower() for word in keywords) if keywords else None
+        self.prefix = prefix.lower() if prefix else None
+        self.fields = dict(fields) if fields else None
+        if self.keywords is None and self.prefix is None and self.fields is None:
+            raise ValueError('Empty news filter')
+
+    def matches(self, title, meta=None, words=None):
+        if self.prefix is not None and not title.lower().startswith(self.prefix):
+            return False
+        if self.keywords is not None and self.keywords.isdisjoint(title_words(title) if words is None else words):
+            return False
+        if self.fields is not None:
+            meta = meta or {}
+            return all(field in meta and meta[field] == value for field, value in self.fields.items())
+        return True
+
+
+class FilterIndex(object):
+    """ Инвертированный индекс отфильтрованных подписок одного узла дерева тем. Подписка попадает в индекс по
+    условию, без которого её фильтр точно не выполнится: по каждому ключевому слову, иначе по одной паре
+    поле-значение с хешируемым значением, иначе по префиксу. Подписки, которые так проиндексировать нельзя
+    (все значения полей - списки и т.п.), проверяются для каждой новости. Для новости берутся только подписки
+    из подходящих корзин индекса, и полный фильтр проверяется только на них
+    """
+    __slots__ = ('subscriptions', 'keywords', 'fields', 'prefixes', 'unindexed')
+
     def __init__(self):
-        self._subscribers = {
-            'sport': set(),
-            'music': set(),
-            'humor': set(),
-        }
-        self.news = []
+        self.subscriptions = {}
+        self.keywords = {}   # слово -> {id читателя: подписка}
+        self.fields = {}     # поле -> {значение: {id читателя: подписка}}
+        self.prefixes = {}   # длина префикса -> {префикс: {id читателя: подписка}}
+        self.unindexed = {}  # None -> {id читателя: подписка}
 
-    def subscribe(self, news_type, reader):
+    @staticmethod
+    def _field(news_filter):
+        """ Первое поле фильтра с хешируемым значением, по нему подписка попадает в индекс """
+        for field, value in news_filter.fields.items():
+            try:
+                hash(value)
+            except TypeError:
+                continue
+            return field
+        return None
+
+    def _buckets(self, news_filter):
+        if news_filter.keywords is not None:
+            return [(self.keywords, word) for word in news_filter.keywords]
+        if news_filter.fields is not None:
+            field = self._field(news_filter)
+            if field is None:
+                return [(self.unindexed, None)]
+            return [(self.fields.setdefault(field, {}), news_filter.fields[field])]
+        return [(self.prefixes.setdefault(len(news_filter.prefix), {}), news_filter.prefix)]
+
+    def add(self, subscription):
+        self.subscriptions[subscription._key] = subscription
+        for index, value in self._buckets(subscription.filter):
+            index.setdefault(value, {})[subscription._key] = subscription
+
+    def remove(self, subscription):
+        del self.subscriptions[subscription._key]
+        news_filter = subscription.filter
+        for index, value in self._buckets(news_filter):
+            bucket = index[value]
+            del bucket[subscription._key]
+            if not bucket:
+                del index[value]
+        if news_filter.keywords is not None:
+            return
+        if news_filter.fields is not None:
+            field = self._field(news_filter)
+            if field is not None and not self.fields[field]:
+                del self.fields[field]
+        elif not self.prefixes[len(news_filter.prefix)]:
+            del self.prefixes[len(news_filter.prefix)]
+
+    def candidates(self, title, meta, words):
+        buckets = [self.keywords[word] for word in words if word in self.keywords]
+        if meta and self.fields:
+            for field, value in meta.items():
+                values = self.fields.get(field)
+                if values is None:
+                    continue
+                try:
+                    bucket = values.get(value)
+                except TypeError:  # нехешируемое значение не равно ни одному проиндексированному
+                    continue
+                if bucket is not None:
+                    buckets.append(bucket)
+        buckets.extend(self.unindexed.values())
+        lowered = title.lower()
+        for length, prefixes in self.prefixes.items():
+            bucket = prefixes.get(lowered[:length])
+            if bucket is not None:
+                buckets.append(bucket)
+        for bucket in buckets:
+            yield from bucket.items()
+
+
+class TopicNode(object):
+    """ Узел дерева тем: дочерние узлы по следующему уровню имени, подписки без фильтра на этот узел
+    (id читателя -> подписка) и индекс подписок с фильтром. Ссылка на родителя нужна, чтобы удалять
+    опустевшие узлы при отписке по объекту подписки
+    """
+    __slots__ = ('children', 'subscribers', 'index', 'parent', 'part')
+
+    def __init__(self, parent=None, part=None):
+        self.children = {}
+        self.subscribers = {}
+        self.index = None
+        self.parent = parent
+        self.part = part
+
+
+class Subscription(object):
+    """ Подписка, которую возвращает subscribe. Хранит ссылку на узел дерева, поэтому отписка по ней - O(1).
+    Слабая подписка (weak=True) не удерживает читателя в памяти и удаляется сама, когда читатель собран сборщиком
+    """
+    __slots__ = ('topic', 'weak', 'filter', '_node', '_key', '_ref', '_trie', '__weakref__')
+
+    def __init__(self, trie, topic, node, reader, weak, news_filter=None):
+        self.topic = topic
+        self.weak = weak
+        self.filter = news_filter
+        self._trie = trie
+        self._node = node
+        self._key = id(reader)
+        self._ref = weakref.ref(reader, self._collected) if weak else reader
+
+    @property
+    def reader(self):
+        """ Читатель или None, если слабая ссылка уже мертва """
+        return self._ref() if self.weak else self._ref
+
+    @property
+    def active(self):
+        return self._node is not None
+
+    def _collected(self, ref):
+        self._trie.discard(self, collected=True)
+
+    def unsubscribe(self):
+        self._trie.discard(self)
+
+
+class TopicTrie(object):
+    """ Префиксное дерево иерархических тем вида 'sport.football.uk'. В подписке допускаются маски:
+    '*' - ровно один уровень ('sport.*.uk'), '#' - любое число уровней, в том числе ноль, только в конце ('sport.#').
+    Поиск подписчиков темы проходит по её уровням, поэтому его стоимость зависит от глубины темы,
+    а не от общего числа подписок
+    """
+    SINGLE = '*'
+    MULTI = '#'
+
+    def __init__(self):
+        self._root = TopicNode()
+        # счётчики для наблюдения за ростом подписок
+        self.nodes = 1
+        self.subscriptions = 0
+        self.weak_subscriptions = 0
+        self.filtered_subscriptions = 0
+        self.collected = 0
+        self.on_discard = None  # вызывается с подпиской после её удаления (отписка или сборка читателя)
+
+    def _parts(self, pattern):
+        parts = pattern.split('.')
+        if self.MULTI in parts[:-1]:
+            raise ValueError(f"'{self.MULTI}' is allowed only at the end of a topic pattern: {pattern}")
+        return parts
+
+    @staticmethod
+    def _find(node, key):
+        subscription = node.subscribers.get(key)
+        if subscription is None and node.index is not None:
+            subscription = node.index.subscriptions.get(key)
+        return subscription
+
+    def add(self, pattern, reader, weak=False, news_filter=None):
+        node = self._root
+        for part in self._parts(pattern):
+            child = node.children.get(part)
+            if child is None:
+                child = node.children[part] = TopicNode(node, part)
+                self.nodes += 1
+            node = child
+
+        old = self._find(node, id(reader))
+        if old is not None:
+            self.discard(old, replaced=True)
+        subscription = Subscription(self, pattern, node, reader, weak, news_filter)
+        if news_filter is None:
+            node.subscribers[subscription._key] = subscription
+        else:
+            if node.index is None:
+                node.index = FilterIndex()
+            node.index.add(subscription)
+            self.filtered_subscriptions += 1
+        self.subscriptions += 1
+        self.weak_subscriptions += weak
+        return subscription
+
+    def discard(self, subscription, collected=False, replaced=False):
+        """ Отписка по объекту подписки: O(1) плюс удаление опустевших узлов вверх по дереву.
+        replaced - подписку заменяет новая подписка того же читателя на тот же узел
+        """
+        node = subscription._node
+        if node is None or self._find(node, subscription._key) is not subscription:
+            return
+        if subscription.filter is None:
+            del node.subscribers[subscription._key]
+        else:
+            node.index.remove(subscription)
+            if not node.index.subscriptions:
+                node.index = None
+            self.filtered_subscriptions -= 1
+        subscription._node = None
+        self.subscriptions -= 1
+        self.weak_subscriptions -= subscription.weak
+        self.collected += collected
+        if replaced:
+            return
+        self._prune(node)
+        if self.on_discard is not None:
+            self.on_discard(subscription)
+
+    def _prune(self, node):
+        while node.parent is not None and not (node.subscribers or node.index or node.children):
+            del node.parent.children[node.part]
+            self.nodes -= 1
+            node = node.parent
+
+    def remove(self, pattern, reader):
+        """ Удаление подписки по теме и читателю """
+        node = self._root
+        for part in self._parts(pattern):
+            node = node.children.get(part)
+            if node is None:
+                return
+        subscription = self._find(node, id(reader))
+        if subscription is not None:
+            self.discard(subscription)
+
+    def match(self, topic, title=None, meta=None):
+        """ Подписчики темы с учётом масок, каждый один раз. Подписки с фильтром учитываются, если передан
+        заголовок title (и метаданные meta) новости и фильтр ему соответствует
+        """
+        parts = topic.split('.')
+        readers = {}
+        content = (title, meta, title_words(title)) if title is not None and self.filtered_subscriptions else None
+        stack = [(self._root, 0)]
+        while stack:
+            node, level = stack.pop()
+            multi = node.children.get(self.MULTI)
+            if multi is not None:
+                self._collect(multi, readers, content)
+            if level == len(parts):
+                self._collect(node, readers, content)
+                continue
+            for part in (parts[level], self.SINGLE):
+                child = node.children.get(part)
+                if child is not None:
+                    stack.append((child, level + 1))
+        return list(readers.values())
+
+    @staticmethod
+    def _collect(node, readers, content):
+        # копия: слабая подписка может удалиться сборщиком прямо во время обхода
+        subscriptions = tuple(node.subscribers.items())
+        if content is not None and node.index is not None:
+            title, meta, words = content
+            matched = ((key, subscription) for key, subscription in node.index.candidates(title, meta, words)
+                       if key not in readers and subscription.filter.matches(title, meta, words))
+            subscriptions += tuple(matched)
+        for key, subscription in subscriptions:
+            reader = subscription.reader
+            if reader is not None:
+                readers[key] = reader
+
+
+class TopicLog(object):
+    """ Кольцевой буфер новостей одной темы фиксированной ёмкости. Время и порядковые номера хранятся в
+    массивах array, заголовки и метаданные - в заранее выделенных списках; при заполнении новая запись вытесняет
+    самую старую. Записи упорядочены по времени, поэтому поиск по времени - бинарный
+    """
+    __slots__ = ('times', 'seqs', 'titles', 'metas', 'start', 'count')
+
+    def __init__(self, capacity):
+        self.times = array('d', bytes(8 * capacity))
+        self.seqs = array('Q', bytes(8 * capacity))
+        self.titles = [None] * capacity
+        self.metas = [None] * capacity
+        self.start = 0
+        self.count = 0
+
+    def _index(self, position):
+        return (self.start + position) % len(self.titles)
+
+    def append(self, timestamp, seq, title, meta=None):
+        """ Добавление записи. Возвращает True, если ради неё вытеснена самая старая """
+        evicted = self.count == len(self.titles)
+        if evicted:
+            self.start = self._index(1)
+            self.count -= 1
+        index = self._index(self.count)
+        self.times[index], self.seqs[index], self.titles[index], self.metas[index] = timestamp, seq, title, meta
+        self.count += 1
+        return evicted
+
+    @property
+    def oldest(self):
+        return self.times[self.start]
+
+    def expire(self, cutoff):
+        """ Удаление записей старше cutoff, возвращает число удалённых """
+        removed = 0
+        while self.count and self.times[self.start] < cutoff:
+            self.titles[self.start] = self.metas[self.start] = None
+            self.start = self._index(1)
+            self.count -= 1
+            removed += 1
+        return removed
+
+    def find(self, timestamp):
+        """ Позиция первой записи не раньше timestamp """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.times[self._index(middle)] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def entries(self, first=0):
+        for position in range(first, self.count):
+            index = self._index(position)
+            yield self.seqs[index], self.titles[index], self.metas[index]
+
+
+class NewsArchive(object):
+    """ Ограниченное хранилище опубликованных новостей: по кольцевому буферу на тему (не больше max_per_topic
+    записей, 0 - не хранить ничего) и, если задан max_age, не старше max_age секунд. Итерация и len дают то же,
+    что прежний список (news_type, title), но только по сохранённым новостям, в порядке публикации.
+    Темы хранятся ещё и деревом по уровням имени, поэтому повтор по маске просматривает только подходящие темы,
+    а устаревшие записи удаляются по куче "время самой старой записи темы" - без обхода всех тем
+    """
+    def __init__(self, max_per_topic=100, max_age=None, clock=time.time):
+        if max_per_topic < 0:
+            raise ValueError(f'max_per_topic must not be negative: {max_per_topic}')
+        self.max_per_topic = max_per_topic
+        self.max_age = max_age
+        self._clock = clock
+        self._logs = {}
+        self._tree = [{}, None]  # [дочерние узлы по уровню имени, тема этого узла]
+        self._oldest = []  # куча (время самой старой записи, тема), по одной записи на тему
+        self._seq = 0
+        self._size = 0
+
+    def append(self, news_type, title, meta=None):
+        if not self.max_per_topic:
+            return
+        timestamp = self._clock()
+        log = self._logs.get(news_type)
+        if log is None:
+            log = self._logs[news_type] = TopicLog(self.max_per_topic)
+            self._insert(news_type)
+            if self.max_age is not None:
+                heapq.heappush(self._oldest, (timestamp, news_type))
+        self._seq += 1
+        self._size += not log.append(timestamp, self._seq, title, meta)
+
+    def _insert(self, news_type):
+        node = self._tree
+        for part in news_type.split('.'):
+            node = node[0].setdefault(part, [{}, None])
+        node[1] = news_type
+
+    def _delete(self, news_type):
+        path = [self._tree]
+        parts = news_type.split('.')
+        for part in parts:
+            path.append(path[-1][0][part])
+        path[-1][1] = None
+        for part, parent, node in zip(reversed(parts), reversed(path[:-1]), reversed(path[1:])):
+            if node[0] or node[1] is not None:
+                break
+            del parent[0][part]
+
+    def _expire(self):
+        """ Устаревшие записи удаляются лениво, при чтении; опустевшие темы удаляются целиком.
+        Просматриваются только темы, самая старая запись которых устарела
+        """
+        if self.max_age is None:
+            return
+        cutoff = self._clock() - self.max_age
+        while self._oldest and self._oldest[0][0] < cutoff:
+            _, news_type = heapq.heappop(self._oldest)
+            log = self._logs[news_type]
+            self._size -= log.expire(cutoff)
+            if log.count:
+                heapq.heappush(self._oldest, (log.oldest, news_type))
+            else:
+                del self._logs[news_type]
+                self._delete(news_type)
+
+    def _select(self, pattern):
+        """ Сохранённые темы, подходящие под маску: точная тема - поиском в словаре, маска - по дереву тем """
+        parts = pattern.split('.')
+        if TopicTrie.SINGLE not in parts and TopicTrie.MULTI not in parts:
+            return [pattern] if pattern in self._logs else []
+
+        found = []
+        stack = [(self._tree, 0)]
+        while stack:
+            node, level = stack.pop()
+            if level == len(parts):
+                if node[1] is not None:
+                    found.append(node[1])
+            elif parts[level] == TopicTrie.MULTI:
+                # '#' - всё поддерево: дочерние узлы остаются на том же уровне маски
+                stack.extend((child, level) for child in node[0].values())
+                if node[1] is not None:
+                    found.append(node[1])
+            elif parts[level] == TopicTrie.SINGLE:
+                stack.extend((child, level + 1) for child in node[0].values())
+            elif parts[level] in node[0]:
+                stack.append((node[0][parts[level]], level + 1))
+        return found
+
+    def _merge(self, selected):
+        """ Слияние записей нескольких тем по порядковому номеру публикации """
+        streams = ([(seq, news_type, title) for seq, title, _ in entries] for news_type, entries in selected)
+        return [(news_type, title) for _, news_type, title in heapq.merge(*streams)]
+
+    def replay(self, pattern, last=None, since=None, news_filter=None):
+        """ Сохранённые новости тем, подходящих под маску pattern: последние last и/или опубликованные
+        не раньше since (время clock), при news_filter - только подходящие под фильтр.
+        Просматриваются только подходящие темы и только нужный хвост их буферов
+        """
+        self._expire()
+        selected = []
+        for news_type in self._select(pattern):
+            log = self._logs[news_type]
+            first = log.find(since) if since is not None else 0
+            if news_filter is not None:
+                entries = [entry for entry in log.entries(first) if news_filter.matches(entry[1], entry[2])]
+                selected.append((news_type, entries if last is None else entries[max(len(entries) - last, 0):]))
+                continue
+            if last is not None:
+                first = max(first, log.count - last)
+            selected.append((news_type, log.entries(first)))
+        found = self._merge(selected)
+        return found if last is None else found[max(len(found) - last, 0):]
+
+    def __iter__(self):
+        self._expire()
+        return iter(self._merge((news_type, log.entries()) for news_type, log in self._logs.items()))
+
+    def __len__(self):
+        self._expire()
+        return self._size
+
+
+class NewsFeed(INewsFeed):
+    """ Конкретный класс издателя. Темы создаются динамически при подписке.
+    Опубликованные новости хранятся в ограниченном архиве news (history записей на тему, не старше max_age секунд).
+    Если задано окно доставки delivery_window (секунды), новости копятся и через окно отправляются каждому
+    подписчику одной пачкой (update_batch), иначе - сразу
+    """
+    def __init__(self, history=100, max_age=None, delivery_window=None):
+        self._subscribers = TopicTrie()
+        self.news = NewsArchive(history, max_age)
+        self.delivery_window = delivery_window
+        self._pending = {}  # id подписчика -> (подписчик, накопленные новости)
+        self._pending_lock = threading.Lock()
+        self._timer = None
+
+    def subscribe(self, news_type, reader, weak=False, replay=None, since=None, keywords=None, prefix=None,
+                  fields=None):
+        """ Подписка на тему. Возвращает объект подписки для отписки за O(1): subscription.unsubscribe().
+        replay - сразу получить последние replay сохранённых новостей темы,
+        since - новости, опубликованные с момента since.
+        keywords, prefix, fields - фильтр по содержимому (NewsFilter): читатель получает только подходящие новости
+        """
         print(f'NewsFeed: new subscriber for {news_type}: {reader.name}')
-        self._subscribers[news_type].add(reader)
+        news_filter = NewsFilter(keywords, prefix, fields) if keywords or prefix or fields else None
+        subscription = self._subscribers.add(news_type, reader, weak, news_filter)
+        if replay is not None or since is not None:
+            found = self.news.replay(news_type, replay, since, news_filter)
+            self._replay(reader, [title for _, title in found])
+        return subscription
+
+    def _replay(self, reader, titles):
+        for title in titles:
+            reader.update(title)
 
     def unsubscribe(self, news_type, reader):
         print(f'NewsFeed: unsubscribed from {news_type}: {reader.name}')
-        self._subscribers[news_type].discard(reader)
+        self._subscribers.remove(news_type, reader)
 
-    def _notify(self, news_type, title):
+    def _notify(self, news_type, title, meta=None):
         print('NewsFeed: Notifying subscribers...')
-        for subscriber in self._subscribers[news_type]:
+        for subscriber in self._subscribers.match(news_type, title, meta):
             subscriber.update(title)
 
-    def add_news(self, news_type, title):
-        self.news.append((news_type, title))
-        self._notify(news_type, title)
+    def add_news(self, news_type, title, meta=None):
+        """ meta - словарь метаданных новости для фильтров подписок по полям """
+        if self.delivery_window is not None:
+            self.add_news_batch([(news_type, title, meta)])
+            return
+        self.news.append(news_type, title, meta)
+        self._notify(news_type, title, meta)
+
+    def add_news_batch(self, items):
+        """ Публикация пачки (news_type, title) или (news_type, title, meta): подписчики ищутся один раз на тему
+        (при подписках с фильтром - на каждую новость), каждый подписчик получает свои новости одним вызовом
+        """
+        batches = {}
+        matched = {}
+        for news_type, title, *meta in items:
+            meta = meta[0] if meta else None
+            self.news.append(news_type, title, meta)
+            if self._subscribers.filtered_subscriptions:
+                subscribers = self._subscribers.match(news_type, title, meta)
+            elif news_type in matched:
+                subscribers = matched[news_type]
+            else:
+                subscribers = matched[news_type] = self._subscribers.match(news_type)
+            for subscriber in subscribers:
+                batches.setdefault(id(subscriber), (subscriber, []))[1].append(title)
+
+        if self.delivery_window is None:
+            print('NewsFeed: Notifying subscribers...')
+            self._deliver_batches(batches.values())
+            return
+        with self._pending_lock:
+            for key, (subscriber, titles) in batches.items():
+                self._pending.setdefault(key, (subscriber, []))[1].extend(titles)
+            if self._timer is None:
+                self._timer = threading.Timer(self.delivery_window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """ Немедленная доставка накопленных в окне новостей """
+        with self._pending_lock:
+            batches, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if batches:
+            print('NewsFeed: Notifying subscribers...')
+            self._deliver_batches(batches.values())
+
+    @staticmethod
+    def _deliver_batches(batches):
+        for subscriber, titles in batches:
+            update_batch = getattr(subscriber, 'update_batch', None)
+            if update_batch is not None and len(titles) > 1:
+                update_batch(titles)
+            else:
+                for title in titles:
+                    subscriber.update(title)
+
+    def stats(self):
+        """ Счётчики подписок: активные, из них слабые и с фильтром, удалённые после сборки читателей,
+        размер дерева тем
+        """
+        return {
+            'subscriptions': self._subscribers.subscriptions,
+            'weak_subscriptions': self._subscribers.weak_subscriptions,
+            'filtered_subscriptions': self._subscribers.filtered_subscriptions,
+            'collected': self._subscribers.collected,
+            'topic_nodes': self._subscribers.nodes,
+        }
+
+
+class AsyncNewsFeed(NewsFeed):
+    """ Издатель с асинхронной доставкой (asyncio). У каждого подписчика своя ограниченная очередь и своя задача
+    доставки, поэтому медленный читатель не задерживает остальных, а add_news завершается, как только новость
+    поставлена в очереди. Синхронный update выполняется в потоке, update-корутина - в цикле событий.
+    При переполнении очереди действует политика overflow:
+     - 'drop_oldest' - самая старая недоставленная новость вытесняется;
+     - 'block' - add_news ждёт освобождения места;
+     - 'disconnect' - подписчик отключается от всех тем
+    """
+    OVERFLOW_POLICIES = ('drop_oldest', 'block', 'disconnect')
+
+    def __init__(self, queue_size=100, overflow='drop_oldest', history=100, max_age=None):
+        super().__init__(history, max_age)
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy: {overflow}')
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.dropped = 0
+        # всё состояние доставки - по id читателя: сам читатель хранится только в подписках,
+        # поэтому слабая подписка не удерживает его в памяти
+        self._subscriptions = {}  # id читателя -> его подписки
+        self._queues = {}
+        self._workers = {}
+        self._subscribers.on_discard = self._discarded
+
+    def subscribe(self, news_type, reader, weak=False, replay=None, since=None, keywords=None, prefix=None,
+                  fields=None):
+        key = id(reader)
+        subscriptions = self._subscriptions.setdefault(key, set())
+        subscription = super().subscribe(news_type, reader, weak, replay, since, keywords, prefix, fields)
+        subscriptions.difference_update([item for item in subscriptions if not item.active])  # заменённые
+        subscriptions.add(subscription)
+        return subscription
+
+    def _discarded(self, subscription):
+        """ Подписка удалена любым способом: unsubscribe, subscription.unsubscribe() или сборка читателя """
+        subscriptions = self._subscriptions.get(subscription._key)
+        if subscriptions is None:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            self._stop_delivery(subscription._key)
+
+    def _replay(self, reader, titles):
+        """ Повтор идёт через очередь подписчика, лишнее вытесняется как при drop_oldest.
+        Вне цикла событий новости ждут в очереди, доставка начнётся с первым add_news или join
+        """
+        queue = self._queue(id(reader))
+        for title in titles:
+            if queue.full():
+                queue.get_nowait()
+                queue.task_done()
+                self.dropped += 1
+            queue.put_nowait(title)
+
+    def disconnect(self, reader):
+        for subscription in list(self._subscriptions.get(id(reader), ())):
+            self.unsubscribe(subscription.topic, reader)
+
+    def _reader(self, key):
+        for subscription in self._subscriptions.get(key, ()):
+            reader = subscription.reader
+            if reader is not None:
+                return reader
+        return None
+
+    def _queue(self, key):
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = asyncio.Queue(self.queue_size)
+        self._start(key)
+        return queue
+
+    def _start(self, key):
+        """ Задача доставки создаётся лениво: subscribe может быть вызван и вне цикла событий """
+        if key in self._workers or key not in self._queues:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._workers[key] = asyncio.create_task(self._deliver(key, self._queues[key]))
+
+    def _stop_delivery(self, key):
+        self._subscriptions.pop(key, None)
+        self._queues.pop(key, None)
+        worker = self._workers.pop(key, None)
+        if worker is not None:
+            worker.cancel()
+
+    async def _deliver(self, key, queue):
+        """ Читатель берётся из подписок на каждую новость и не удерживается задачей между новостями """
+        while True:
+            title = await queue.get()
+            reader = self._reader(key)
+            try:
+                if reader is None:
+                    continue
+                if iscoroutinefunction(reader.update):
+                    await reader.update(title)
+                else:
+                    await asyncio.to_thread(reader.update, title)
+            except Exception as error:
+                print(f'NewsFeed: delivery to {reader.name} failed: {error!r}')
+            finally:
+                reader = None
+                queue.task_done()
+
+    async def _notify(self, news_type, title, meta=None):
+        for subscriber in self._subscribers.match(news_type, title, meta):
+            queue = self._queue(id(subscriber))
+            if not queue.full():
+                queue.put_nowait(title)
+            elif self.overflow == 'block':
+                await queue.put(title)
+            elif self.overflow == 'drop_oldest':
+                queue.get_nowait()
+                queue.task_done()
+                queue.put_nowait(title)
+                self.dropped += 1
+            else:
+                print(f'NewsFeed: {subscriber.name} is too slow, disconnecting')
+                self.disconnect(subscriber)
+
+    async def add_news(self, news_type, title, meta=None):
+        self.news.append(news_type, title, meta)
+        await self._notify(news_type, title, meta)
+
+    async def add_news_batch(self, items):
+        """ Очереди подписчиков уже развязывают издателя и доставку, поэтому пачка ставится в них по одной новости """
+        for news_type, title, *meta in items:
+            await self.add_news(news_type, title, *meta)
+
+    async def join(self):
+        """ Ожидание доставки всех поставленных в очереди новостей """
+        for key in list(self._queues):
+            self._start(key)
+        await asyncio.gather(*(queue.join() for queue in list(self._queues.values())))
+
+    async def close(self):
+        for key in list(self._workers):
+            self._stop_delivery(key)
+
+
+class SlowReader(Reader):
+    """ Подписчик, обрабатывающий новость с задержкой """
+    async def update(self, msg):
+        await asyncio.sleep(0.01)
+        print(f'New article for {self.name} (slow): {msg}')
 
 
 if __name__ == '__main__':
@@ -97,4 +826,50 @@ if __name__ == '__main__':
     news.add_news('music', 'Music article')
     news.add_news('humor', 'Humor article')
 
-    news.unsubscribe('humor', ringo)
\ No newline at end of file
+    news.unsubscribe('humor', ringo)
+
+    news.subscribe('sport.#', paul)
+    news.subscribe('sport.*.uk', ringo)
+    news.subscribe('sport.football.uk', john)
+    news.add_news('sport.football.uk', 'Premier League results')
+    news.add_news('sport.tennis.fr', 'Roland Garros final')
+    news.add_news('politics', 'Nobody is subscribed')
+
+    subscription = news.subscribe('music', Reader('Temporary'), weak=True)  # читателя больше никто не держит
+    gc.collect()
+    print(subscription.active, news.stats())
+    handle = news.subscribe('music', ringo)
+    handle.unsubscribe()
+    print(news.stats())
+
+    news.subscribe('sport.#', Reader('Latecomer'), replay=1)
+    print(len(news.news), list(news.news))
+
+    burst = NewsFeed(delivery_window=0.05)
+    burst.subscribe('markets.#', paul)
+    burst.subscribe('markets.fx', george)
+    burst.add_news_batch([('markets.fx', 'EUR up'), ('markets.stocks', 'Index down')])
+    burst.add_news('markets.fx', 'USD flat')
+    time.sleep(0.1)
+
+    filtered = NewsFeed()
+    filtered.subscribe('sport.#', john, keywords={'Messi', 'Ronaldo'})
+    filtered.subscribe('sport.#', george, prefix='Breaking')
+    filtered.subscribe('sport.#', ringo, fields={'country': 'uk'})
+    filtered.add_news('sport.football', 'Messi scores twice')
+    filtered.add_news('sport.football', 'Breaking: transfer window closes', {'country': 'uk'})
+    filtered.add_news('sport.tennis', 'Quiet day at the courts')
+    print(filtered.stats())
+
+    async def publish():
+        feed = AsyncNewsFeed(queue_size=2, overflow='drop_oldest')
+        feed.subscribe('sport.#', Reader('Fast'))
+        feed.subscribe('sport.#', SlowReader('Slow'))
+        for number in range(5):
+            await feed.add_news('sport.chess', f'Round {number}')
+            await asyncio.sleep(0.002)  # издатель занят своей работой, быстрый читатель успевает
+        await feed.join()
+        print(f'Dropped for slow readers: {feed.dropped}')
+        await feed.close()
+
+    asyncio.run(publish())
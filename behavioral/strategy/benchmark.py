@@ -0,0 +1,195 @@
+# Бенчмарк стратегий сортировки и калибровка SortMachine.
+#    Замеряет время каждой стратегии ISortStrategy на нескольких распределениях входных данных (случайные,
+#    отсортированные, развёрнутые, с малым числом уникальных значений, почти отсортированные) и нескольких размерах.
+#    Результат сохраняется в калибровочный профиль (JSON), который принимает SortMachine.from_calibration_file.
+#    Замеры можно сравнить с сохранённым базовым прогоном, чтобы увидеть регрессии.
+# Использование:
+#    python benchmark.py --sizes 100 1000 10000 --save-profile calibration.json
+#    python benchmark.py --save-baseline baseline.json
+#    python benchmark.py --baseline baseline.json --tolerance 0.2
+
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+from random import randint
+from time import perf_counter
+
+from strategy import BubbleSortStrategy, InsertionSortStrategy, NumpySortStrategy, ParallelSortStrategy, SortMachine, np
+
+QUADRATIC = (BubbleSortStrategy, InsertionSortStrategy)
+QUADRATIC_LIMIT = 2000  # квадратичные стратегии на больших размерах не замеряются
+
+
+def random_data(n):
+    return [randint(-10 ** 9, 10 ** 9) for _ in range(n)]
+
+
+def sorted_data(n):
+    return sorted(random_data(n))
+
+
+def reversed_data(n):
+    return sorted(random_data(n), reverse=True)
+
+
+def few_unique_data(n):
+    return [randint(0, 9) for _ in range(n)]
+
+
+def nearly_sorted_data(n):
+    data = sorted_data(n)
+    for _ in range(max(1, n // 100)):
+        i, k = randint(0, n - 1), randint(0, n - 1)
+        data[i], data[k] = data[k], data[i]
+    return data
+
+
+DISTRIBUTIONS = {
+    'random': random_data,
+    'sorted': sorted_data,
+    'reversed': reversed_data,
+    'few_unique': few_unique_data,
+    'nearly_sorted': nearly_sorted_data,
+}
+
+
+def candidates():
+    strategies = dict(SortMachine.STRATEGIES)
+    if np is not None:
+        strategies[NumpySortStrategy.__name__] = NumpySortStrategy
+    return strategies
+
+
+def measure(strategy_cls, data, repeat):
+    """ Лучшее время из repeat запусков, каждый запуск - на свежей копии данных """
+    best = float('inf')
+    for _ in range(repeat):
+        lst = list(data)
+        strategy = strategy_cls()
+        with contextlib.redirect_stdout(io.StringIO()):  # стратегии печатают сообщение о запуске
+            start = perf_counter()
+            strategy.sort(lst)
+            best = min(best, perf_counter() - start)
+    return best
+
+
+def measurable(strategy_cls, size, profile):
+    """ Замеряются только стратегии, которые на таком входе работают сами, а не через запасной путь:
+    квадратичные - до QUADRATIC_LIMIT, параллельная - только когда действительно запускает пул процессов
+    """
+    if issubclass(strategy_cls, QUADRATIC):
+        return size <= QUADRATIC_LIMIT
+    if strategy_cls is ParallelSortStrategy:
+        return strategy_cls.supports(profile) and ParallelSortStrategy().runs_in_parallel(size)
+    return strategy_cls is NumpySortStrategy or strategy_cls.supports(profile)
+
+
+def run_benchmark(sizes, repeat=3, distributions=None):
+    """ Замеры в виде {распределение: {размер: {стратегия: секунды}}} """
+    machine = SortMachine()
+    timings = {}
+    for name in distributions or DISTRIBUTIONS:
+        timings[name] = {}
+        for size in sizes:
+            data = DISTRIBUTIONS[name](size)
+            profile = machine.profile(data)
+            timings[name][str(size)] = {
+                strategy_name: measure(strategy_cls, data, repeat)
+                for strategy_name, strategy_cls in candidates().items()
+                if measurable(strategy_cls, size, profile)
+            }
+    return timings
+
+
+def parallel_threshold(ranking):
+    """ Наименьший размер, начиная с которого ParallelSortStrategy быстрее остальных на всех бо́льших замерах
+    хотя бы одного распределения; None, если такого размера нет
+    """
+    name = ParallelSortStrategy.__name__
+    thresholds = []
+    for by_size in ranking.values():
+        threshold = None
+        for size in sorted(by_size, key=int, reverse=True):
+            if not by_size[size] or by_size[size][0] != name:
+                break
+            threshold = int(size)
+        if threshold is not None:
+            thresholds.append(threshold)
+    return min(thresholds, default=None)
+
+
+def build_calibration(timings):
+    """ Калибровочный профиль: замеры, рейтинг стратегий от быстрой к медленной и порог параллельной сортировки """
+    ranking = {
+        name: {size: sorted(results, key=results.get) for size, results in by_size.items()}
+        for name, by_size in timings.items()
+    }
+    return {'timings': timings, 'ranking': ranking, 'parallel_threshold': parallel_threshold(ranking)}
+
+
+def find_regressions(timings, baseline, tolerance=0.2):
+    """ Замеры, ставшие медленнее базовых более чем на tolerance (доля) """
+    regressions = []
+    for name, by_size in timings.items():
+        for size, results in by_size.items():
+            for strategy_name, seconds in results.items():
+                base = baseline.get(name, {}).get(size, {}).get(strategy_name)
+                if base and seconds > base * (1 + tolerance):
+                    regressions.append((name, size, strategy_name, base, seconds))
+    return regressions
+
+
+def print_table(timings, regressions=()):
+    flagged = {(name, size, strategy_name) for name, size, strategy_name, _, _ in regressions}
+    strategy_names = sorted({item for by_size in timings.values() for res in by_size.values() for item in res})
+    header = f'{"distribution":<14}{"size":>8}'
+    header += ''.join(f'{item[:-len("SortStrategy")]:>12}' for item in strategy_names)
+    print(header)
+    print('-' * len(header))
+    for name, by_size in timings.items():
+        for size, results in by_size.items():
+            row = f'{name:<14}{size:>8}'
+            for strategy_name in strategy_names:
+                if strategy_name not in results:
+                    row += f'{"-":>12}'
+                    continue
+                mark = '!' if (name, size, strategy_name) in flagged else ' '
+                row += f'{results[strategy_name] * 1000:>10.2f}{mark} '
+            print(row)
+    print('(ms, best of repeats; ! - regression against baseline)')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark ISortStrategy implementations and calibrate SortMachine')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--distributions', nargs='+', choices=sorted(DISTRIBUTIONS))
+    parser.add_argument('--save-profile', help='write calibration profile for SortMachine')
+    parser.add_argument('--save-baseline', help='write timings as a baseline for later runs')
+    parser.add_argument('--baseline', help='compare timings against a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown against baseline (fraction)')
+    args = parser.parse_args(argv)
+
+    timings = run_benchmark(args.sizes, args.repeat, args.distributions)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(timings, json.load(f)['timings'], args.tolerance)
+
+    print_table(timings, regressions)
+
+    for path in filter(None, (args.save_profile, args.save_baseline)):
+        with open(path, 'w') as f:
+            json.dump(build_calibration(timings), f, indent=2)
+
+    for name, size, strategy_name, base, seconds in regressions:
+        print(f'REGRESSION {name}/{size} {strategy_name}: {base * 1000:.2f} ms -> {seconds * 1000:.2f} ms')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
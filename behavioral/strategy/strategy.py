@@ -14,16 +14,110 @@
 #    определённым образом.
 
 
+import heapq
+import json
+import math
+import mmap
+import os
+import struct
+import tempfile
 from abc import ABCMeta, abstractmethod
-from random import randint
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+from multiprocessing import shared_memory
+from random import randint, randrange, sample
+
+try:
+    import numpy as np
+except ImportError:  # NumPy-стратегии доступны только при установленном numpy
+    np = None
 
 
 class ISortStrategy(metaclass=ABCMeta):
     """ Абстрактный класс сортировки """
+    PACK_LIMIT = 2 ** 63  # целочисленные ключи упаковываются в одно число, пока оно помещается в int64
+
     @abstractmethod
     def sort(self, lst):
         pass
 
+    @classmethod
+    def supports(cls, profile):
+        """ Может ли стратегия отсортировать на месте список с данным профилем (см. SortMachine.profile) """
+        return True
+
+    def sort_by(self, lst, key=None, reverse=False, keys=None):
+        """ Устойчивая сортировка по ключу (decorate-sort-undecorate). Ключ вычисляется один раз на элемент
+        (или передаётся готовым списком keys), элементы между собой не сравниваются
+        """
+        if key is None and keys is None and not reverse:
+            return self.sort(lst)
+
+        items = lst if isinstance(lst, list) else list(lst)
+        if keys is None:
+            keys = list(map(key, items)) if key else items
+        decorated, restore = self._decorate(items, keys, reverse)
+
+        result = [restore(item) for item in self.sort(decorated)]
+        if reverse:
+            result.reverse()
+        if isinstance(lst, list):
+            lst[:] = result
+            return lst
+        return result
+
+    def sort_by_columns(self, lst, columns):
+        """ Сортировка по нескольким столбцам: columns - список функций-ключей или пар (ключ, reverse).
+        Числовые столбцы сводятся в один составной ключ и сортируются за один проход,
+        иначе выполняются последовательные устойчивые проходы от последнего столбца к первому
+        """
+        if not lst:
+            return lst
+        columns = [column if isinstance(column, tuple) else (column, False) for column in columns]
+        values = [list(map(key, lst)) for key, _ in columns]
+
+        if all(type(value) in (int, float) for column in values for value in column):
+            composite = [tuple(-value if rev else value for value, (_, rev) in zip(row, columns))
+                         for row in zip(*values)]
+            if all(type(value) is int for column in values for value in column):
+                composite = self._pack_columns(values, [rev for _, rev in columns])
+            return self.sort_by(lst, keys=composite)
+
+        for column, (_, rev) in reversed(list(zip(values, columns))):
+            order = self.sort_by(list(range(len(lst))), keys=column, reverse=rev)
+            lst[:] = [lst[i] for i in order]
+            for other in values:
+                other[:] = [other[i] for i in order]
+        return lst
+
+    @staticmethod
+    def _pack_columns(values, reverses):
+        """ Целочисленные столбцы сводятся в одно число по смешанному основанию """
+        packed = [0] * len(values[0])
+        for column, rev in zip(values, reverses):
+            low, high = min(column), max(column)
+            base = high - low + 1
+            packed = [acc * base + (high - value if rev else value - low) for acc, value in zip(packed, column)]
+        return packed
+
+    def _decorate(self, items, keys, reverse):
+        """ Декорирование ключей номером элемента. При reverse номера берутся в обратном порядке, чтобы после
+        разворота результата равные элементы сохранили исходный порядок. Целые ключи упаковываются
+        в одно число key * n + номер, иначе используются пары (ключ, номер)
+        """
+        n = len(items)
+        ties = range(n - 1, -1, -1) if reverse else range(n)
+
+        if n and all(type(k) is int for k in keys):
+            low = min(keys)
+            if self.PACK_LIMIT is None or (max(keys) - low + 1) * n < self.PACK_LIMIT:
+                decorated = [(k - low) * n + tie for k, tie in zip(keys, ties)]
+                return decorated, lambda packed: items[ties[packed % n]]
+
+        return list(zip(keys, ties)), lambda pair: items[ties[pair[1]]]
+
 
 class BubbleSortStrategy(ISortStrategy):
     """ Конкретный класс пузырьковой сортировки """
@@ -52,6 +146,493 @@ class InsertionSortStrategy(ISortStrategy):
         return lst
 
 
+class MergeSortStrategy(ISortStrategy):
+    """ Конкретный класс сортировки слиянием естественных серий (по мотивам Timsort).
+    Уже упорядоченные участки списка не пересортировываются, короткие серии добиваются вставками до MIN_RUN
+    """
+    MIN_RUN = 32
+
+    def sort(self, lst):
+        print('Merge sort performing...')
+
+        runs = self._find_runs(lst)
+        while len(runs) > 1:
+            merged = [self._merge(runs[i], runs[i + 1]) for i in range(0, len(runs) - 1, 2)]
+            if len(runs) % 2:
+                merged.append(runs[-1])
+            runs = merged
+
+        lst[:] = runs[0] if runs else []
+        return lst
+
+    def _find_runs(self, lst):
+        """ Разбиение списка на упорядоченные серии.
+        Строго убывающие серии разворачиваются (устойчивость сохраняется)
+        """
+        runs = []
+        n = len(lst)
+        start = 0
+        while start < n:
+            end = start + 1
+            if end < n and lst[end] < lst[start]:
+                while end < n and lst[end] < lst[end - 1]:
+                    end += 1
+                run = lst[start:end]
+                run.reverse()
+            else:
+                while end < n and not lst[end] < lst[end - 1]:
+                    end += 1
+                run = lst[start:end]
+
+            # короткую серию добиваем следующими элементами бинарными вставками
+            while len(run) < self.MIN_RUN and end < n:
+                insort(run, lst[end])
+                end += 1
+
+            runs.append(run)
+            start = end
+        return runs
+
+    @staticmethod
+    def _merge(left, right):
+        result = []
+        i = k = 0
+        while i < len(left) and k < len(right):
+            if right[k] < left[i]:
+                result.append(right[k])
+                k += 1
+            else:
+                result.append(left[i])
+                i += 1
+        result.extend(left[i:])
+        result.extend(right[k:])
+        return result
+
+
+class CountingSortStrategy(ISortStrategy):
+    """ Конкретный класс сортировки подсчётом. Подходит для целых чисел из небольшого диапазона значений """
+    RANGE_FACTOR = 2  # подсчёт выгоден, пока диапазон значений не больше длины списка в N раз
+
+    @classmethod
+    def supports(cls, profile):
+        return profile['integers'] and profile['span'] <= max(profile['length'], 1) * cls.RANGE_FACTOR
+
+    def sort(self, lst):
+        print('Counting sort performing...')
+
+        if not lst:
+            return lst
+
+        low = min(lst)
+        counts = [0] * (max(lst) - low + 1)
+        for item in lst:
+            counts[item - low] += 1
+
+        pos = 0
+        for offset, count in enumerate(counts):
+            if count:
+                lst[pos:pos + count] = [offset + low] * count
+                pos += count
+
+        return lst
+
+    def sort_by(self, lst, key=None, reverse=False, keys=None):
+        """ Устойчивая сортировка подсчётом по целочисленному ключу: элементы раскладываются по корзинам ключей """
+        if key is None and keys is None and not reverse:
+            return self.sort(lst)
+        print('Counting sort performing...')
+
+        if keys is None:
+            keys = list(map(key, lst)) if key else list(lst)
+        if not keys:
+            return lst
+
+        low = min(keys)
+        buckets = [[] for _ in range(max(keys) - low + 1)]
+        for item, k in zip(lst, keys):
+            buckets[k - low].append(item)
+        if reverse:
+            buckets.reverse()
+        lst[:] = [item for bucket in buckets for item in bucket]
+        return lst
+
+
+class RadixSortStrategy(ISortStrategy):
+    """ Конкретный класс поразрядной сортировки (LSD) для целых чисел. Отрицательные числа сдвигаются на минимум """
+    BITS = 8
+    PACK_LIMIT = None  # поразрядная сортировка работает с целыми любой длины
+
+    @classmethod
+    def supports(cls, profile):
+        return profile['integers']
+
+    def sort(self, lst):
+        print('Radix sort performing...')
+
+        if not lst:
+            return lst
+
+        low = min(lst)
+        values = [item - low for item in lst]
+        mask = (1 << self.BITS) - 1
+        shift = 0
+        highest = max(values)
+        while highest >> shift:
+            buckets = [[] for _ in range(mask + 1)]
+            for value in values:
+                buckets[(value >> shift) & mask].append(value)
+            values = [value for bucket in buckets for value in bucket]
+            shift += self.BITS
+
+        lst[:] = [value + low for value in values]
+        return lst
+
+
+class NumpySortStrategy(ISortStrategy):
+    """ Конкретный класс векторизованной сортировки числовых данных средствами NumPy.
+    Результат остаётся массивом numpy.ndarray, без обратного преобразования в список Python
+    """
+    def __init__(self, kind='quicksort'):
+        if np is None:
+            raise ImportError('NumpySortStrategy requires numpy')
+        self.kind = kind
+
+    @classmethod
+    def supports(cls, profile):
+        return False  # возвращает новый ndarray, а не исходный отсортированный список
+
+    def sort(self, lst):
+        print('NumPy sort performing...')
+
+        if isinstance(lst, np.ndarray):
+            lst.sort(kind=self.kind)
+            return lst
+        return np.sort(np.asarray(lst), kind=self.kind)
+
+    def sort_by(self, lst, key=None, reverse=False, keys=None):
+        """ Сортировка по ключу через устойчивый argsort массива ключей """
+        print('NumPy argsort performing...')
+
+        if keys is None:
+            keys = lst if key is None else list(map(key, lst))
+        keys = np.asarray(keys)
+        if reverse:
+            order = len(keys) - 1 - np.argsort(keys[::-1], kind='stable')[::-1]
+        else:
+            order = np.argsort(keys, kind='stable')
+
+        if isinstance(lst, np.ndarray):
+            return lst[order]
+        return [lst[i] for i in order]
+
+
+class NumpyBatchSortStrategy(ISortStrategy):
+    """ Конкретный класс пакетной сортировки множества небольших числовых списков за один векторизованный проход.
+    Списки склеиваются в один массив и сортируются по паре ключей (номер сегмента, значение), после чего
+    массив разрезается обратно на сегменты. Списки одинаковой длины сортируются построчно как двумерный массив
+    """
+    def __init__(self):
+        if np is None:
+            raise ImportError('NumpyBatchSortStrategy requires numpy')
+
+    @classmethod
+    def supports(cls, profile):
+        return False  # сортирует список списков, а не один список
+
+    def sort(self, lst):
+        print('NumPy batch sort performing...')
+
+        if not len(lst):
+            return []
+
+        lengths = np.fromiter((len(item) for item in lst), dtype=np.intp, count=len(lst))
+        if (lengths == lengths[0]).all():
+            return list(np.sort(np.asarray(lst).reshape(len(lst), int(lengths[0])), axis=1))
+
+        flat = np.asarray(list(chain.from_iterable(lst)))
+        segments = np.repeat(np.arange(len(lst)), lengths)
+        order = np.lexsort((flat, segments))  # последний ключ - основной
+        return np.split(flat[order], np.cumsum(lengths)[:-1])
+
+
+class ExternalMergeSortStrategy(ISortStrategy):
+    """ Конкретный класс внешней сортировки слиянием для данных, не помещающихся в память.
+    Вход читается порциями по run_size элементов, каждая порция сортируется и сбрасывается во временный файл
+    в виде записей фиксированной ширины, после чего серии сливаются через кучу (k-way merge).
+    Одновременно сливается не больше MAX_FAN_IN серий: если серий больше, они сливаются в несколько проходов.
+    Серии читаются через mmap, результат отдаётся генератором
+    """
+    MAX_FAN_IN = 64  # ограничивает число одновременно открытых файлов
+
+    def __init__(self, run_size=1000000, record_format='<q', tmp_dir=None):
+        self.run_size = run_size
+        self.record = struct.Struct(record_format)  # '<q' - int64, '<d' - float64
+        self.tmp_dir = tmp_dir
+        order = record_format[0] if record_format[0] in '@=<>!' else ''
+        self._order, self._code = order, record_format[len(order):]
+
+    @classmethod
+    def supports(cls, profile):
+        return False  # возвращает генератор, а не отсортированный список
+
+    def sort(self, lst):
+        print('External merge sort performing...')
+        return self._merge_runs(lst)
+
+    def _merge_runs(self, iterable):
+        with tempfile.TemporaryDirectory(dir=self.tmp_dir) as tmp_dir:
+            paths = self._spill_runs(iter(iterable), tmp_dir)
+            while len(paths) > self.MAX_FAN_IN:
+                merged = []
+                for i in range(0, len(paths), self.MAX_FAN_IN):
+                    group = paths[i:i + self.MAX_FAN_IN]
+                    path = os.path.join(tmp_dir, f'merge_{len(paths)}_{i}.bin')
+                    self._write_run(heapq.merge(*(self._read_run(run) for run in group)), path)
+                    for run in group:
+                        os.remove(run)
+                    merged.append(path)
+                paths = merged
+            yield from heapq.merge(*(self._read_run(path) for path in paths))
+
+    def _spill_runs(self, items, tmp_dir):
+        """ Запись отсортированных серий во временные файлы """
+        paths = []
+        while True:
+            run = list(islice(items, self.run_size))
+            if not run:
+                return paths
+            run.sort()
+            path = os.path.join(tmp_dir, f'run_{len(paths)}.bin')
+            self._write_run(run, path)
+            paths.append(path)
+
+    def _write_run(self, items, path):
+        """ Запись упорядоченных значений порциями по run_size записей в формате record_format """
+        items = iter(items)
+        with open(path, 'wb') as f:
+            while True:
+                chunk = list(islice(items, self.run_size))
+                if not chunk:
+                    return
+                f.write(struct.pack(f'{self._order}{len(chunk)}{self._code}', *chunk))
+
+    def _read_run(self, path):
+        """ Построчное (по записям) чтение серии через отображение файла в память """
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            size = self.record.size
+            for offset in range(0, len(buf), size):
+                yield self.record.unpack_from(buf, offset)[0]
+
+
+def _sort_shared_block(name, typecode, length):
+    """ Сортировка блока разделяемой памяти в процессе-исполнителе (функция уровня модуля для передачи в пул) """
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        view = block.buf[:length * array(typecode).itemsize].cast(typecode)
+        view[:] = array(typecode, sorted(view))
+        view.release()
+    finally:
+        block.close()
+
+
+class ParallelSortStrategy(ISortStrategy):
+    """ Конкретный класс параллельной сортировки выборкой (sample sort).
+    По случайной выборке выбираются разделители, список разбивается на непересекающиеся по значениям части,
+    части сортируются в пуле процессов. Данные передаются через разделяемую память, а не сериализацией списков.
+    Поддерживаются только int64 и float, прочие данные сортируются в текущем процессе слиянием
+    """
+    OVERSAMPLING = 32  # элементов выборки на каждый разделитель
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+
+    @classmethod
+    def supports(cls, profile):
+        return profile['numeric']
+
+    def sort(self, lst):
+        print('Parallel sort performing...')
+
+        typecode = self._typecode(lst)
+        if typecode is None or not self.runs_in_parallel(len(lst)):
+            return MergeSortStrategy().sort(lst)
+
+        splitters = self._splitters(lst)
+        partitions = [[] for _ in range(len(splitters) + 1)]
+        for item in lst:
+            partitions[bisect_right(splitters, item)].append(item)
+
+        blocks = []
+        try:
+            for part in partitions:
+                data = array(typecode, part)
+                block = shared_memory.SharedMemory(create=True, size=max(1, len(data) * data.itemsize))
+                blocks.append(block)
+                block.buf[:len(data) * data.itemsize] = data.tobytes()
+
+            with ProcessPoolExecutor(self.workers) as pool:
+                list(pool.map(_sort_shared_block, [block.name for block in blocks],
+                              [typecode] * len(blocks), [len(part) for part in partitions]))
+
+            pos = 0
+            for block, part in zip(blocks, partitions):
+                data = array(typecode)
+                data.frombytes(block.buf[:len(part) * data.itemsize])
+                lst[pos:pos + len(part)] = data.tolist()
+                pos += len(part)
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+        return lst
+
+    def runs_in_parallel(self, length):
+        """ Хватает ли ядер и данных для пула; иначе список сортируется в текущем процессе слиянием """
+        return self.workers >= 2 and length >= self.workers * self.OVERSAMPLING
+
+    def _splitters(self, lst):
+        """ Разделители берутся равномерно из отсортированной случайной выборки """
+        probe = sorted(sample(lst, min(len(lst), self.workers * self.OVERSAMPLING)))
+        return probe[self.OVERSAMPLING::self.OVERSAMPLING][:self.workers - 1]
+
+    @staticmethod
+    def _typecode(lst):
+        types = set(map(type, lst))
+        if types == {int} and -2 ** 63 <= min(lst) and max(lst) < 2 ** 63:
+            return 'q'
+        if types == {float}:
+            return 'd'
+        return None
+
+
+class HeapTopKStrategy(ISortStrategy):
+    """ Конкретный класс частичной сортировки: k наименьших (или наибольших) элементов через кучу за O(n log k).
+    Возвращает новый отсортированный список из k элементов, исходный список не изменяется
+    """
+    def __init__(self, k, largest=False):
+        self.k = k
+        self.largest = largest
+
+    @classmethod
+    def supports(cls, profile):
+        return False  # сортирует не весь список
+
+    def sort(self, lst):
+        print('Heap top-k performing...')
+        return heapq.nlargest(self.k, lst) if self.largest else heapq.nsmallest(self.k, lst)
+
+    def sort_by(self, lst, key=None, reverse=False, keys=None):
+        print('Heap top-k performing...')
+
+        largest = self.largest != reverse
+        if keys is not None:
+            pairs = heapq.nlargest(self.k, zip(keys, lst), key=lambda pair: pair[0]) if largest else \
+                heapq.nsmallest(self.k, zip(keys, lst), key=lambda pair: pair[0])
+            return [item for _, item in pairs]
+        return heapq.nlargest(self.k, lst, key=key) if largest else heapq.nsmallest(self.k, lst, key=key)
+
+
+class QuickSelectStrategy(ISortStrategy):
+    """ Конкретный класс частичной сортировки быстрым выбором (quickselect) за O(n) в среднем.
+    Переставляет элементы исходного списка так, что k наименьших (или наибольших) оказываются в начале,
+    сортирует только их и возвращает срез из k элементов
+    """
+    def __init__(self, k, largest=False):
+        self.k = k
+        self.largest = largest
+
+    @classmethod
+    def supports(cls, profile):
+        return False  # сортирует не весь список
+
+    def sort(self, lst):
+        print('Quickselect top-k performing...')
+
+        k = min(self.k, len(lst))
+        before = (lambda a, b: b < a) if self.largest else (lambda a, b: a < b)
+        low, high = 0, len(lst)
+        while high - low > 1 and low < k < high:
+            pivot = lst[randrange(low, high)]
+            # трёхпутевое разбиение: [low, lt) - до опорного, [lt, gt) - равные, [gt, high) - после
+            lt, i, gt = low, low, high
+            while i < gt:
+                if before(lst[i], pivot):
+                    lst[lt], lst[i] = lst[i], lst[lt]
+                    lt += 1
+                    i += 1
+                elif before(pivot, lst[i]):
+                    gt -= 1
+                    lst[gt], lst[i] = lst[i], lst[gt]
+                else:
+                    i += 1
+            if k < lt:
+                high = lt
+            elif k > gt:
+                low = gt
+            else:
+                break
+
+        top = sorted(lst[:k], reverse=self.largest)
+        lst[:k] = top
+        return top
+
+    def sort_by(self, lst, key=None, reverse=False, keys=None):
+        """ Быстрый выбор по декорированным ключам. Равные ключи остаются в исходном порядке """
+        largest = self.largest != reverse
+        items = lst if isinstance(lst, list) else list(lst)
+        if keys is None:
+            keys = list(map(key, items)) if key else items
+        decorated, restore = self._decorate(items, keys, largest)
+        return [restore(item) for item in QuickSelectStrategy(self.k, largest).sort(decorated)]
+
+
+class SortedList(object):
+    """ Отсортированный контейнер: поиск места вставки бинарный (bisect), новые пачки элементов вливаются
+    слиянием, без пересортировки всего содержимого
+    """
+    def __init__(self, iterable=()):
+        self._items = sorted(iterable)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __contains__(self, item):
+        i = bisect_left(self._items, item)
+        return i < len(self._items) and self._items[i] == item
+
+    def add(self, item):
+        insort(self._items, item)
+
+    def update(self, batch):
+        """ Вливание пачки: маленькая пачка вставляется поэлементно, большая сортируется и сливается за O(n + m) """
+        batch = list(batch)
+        if len(batch) * max(len(self._items), 1).bit_length() < len(self._items):
+            for item in batch:
+                insort(self._items, item)
+        else:
+            batch.sort()
+            self._items = list(heapq.merge(self._items, batch))
+
+    def remove(self, item):
+        i = bisect_left(self._items, item)
+        if i == len(self._items) or self._items[i] != item:
+            raise ValueError(f'{item!r} not in SortedList')
+        del self._items[i]
+
+    def smallest(self, k):
+        return self._items[:k]
+
+    def largest(self, k):
+        return self._items[:-k - 1:-1] if k else []
+
+
 class Context(object):
     """ Класс контекста для хранения и изменения ссылки на конкретную стратегию сортировки """
     def __init__(self):
@@ -66,31 +647,191 @@ class Context(object):
         """ Изменение выбранной стратегии сортировки """
         self._strategy = val
 
-    def sort(self, lst):
+    def sort(self, lst, key=None, reverse=False, keys=None):
         """ Сортировать список, используя метод выбранной стратегии сортировки """
-        return self._strategy.sort(lst)
+        if key is None and keys is None and not reverse:
+            return self._strategy.sort(lst)
+        return self._strategy.sort_by(lst, key, reverse, keys)
+
+    def sort_by_columns(self, lst, columns):
+        return self._strategy.sort_by_columns(lst, columns)
 
 
 class SortMachine(object):
-    """ Класс сортировочной машины, выбирает стратегию сортировки на основе длины списка """
-    def __init__(self):
+    """ Класс сортировочной машины. Перед сортировкой снимает профиль списка (длина, тип элементов, диапазон
+    значений, степень упорядоченности) и на его основе выбирает стратегию сортировки.
+    Если задан калибровочный профиль (см. benchmark.py), стратегия берётся из измеренного рейтинга для ближайшего
+    размера и распределения входных данных, иначе - по встроенным порогам
+    """
+    PARALLEL_THRESHOLD = 1000000  # порог параллельной сортировки без калибровки; с профилем берётся из замеров
+    INSERTION_THRESHOLD = 32  # до этой длины вставки быстрее за счёт отсутствия накладных расходов
+    NEARLY_SORTED = 0.9  # доля упорядоченных соседних пар, начиная с которой список считается почти отсортированным
+    SAMPLE_SIZE = 100
+    STRATEGIES = {cls.__name__: cls for cls in (
+        BubbleSortStrategy, InsertionSortStrategy, MergeSortStrategy, CountingSortStrategy, RadixSortStrategy,
+        ParallelSortStrategy,
+    )}
+
+    def __init__(self, calibration=None):
         self.context = Context()
+        self.calibration = calibration
+        self.parallel_threshold = self.PARALLEL_THRESHOLD
+        if calibration and 'parallel_threshold' in calibration:
+            # None - на измеренных размерах пул процессов ни разу не окупился
+            self.parallel_threshold = calibration['parallel_threshold'] or math.inf
+
+    @classmethod
+    def from_calibration_file(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def profile(self, lst):
+        """ Профиль списка: длина, признак целых чисел, диапазон значений и степень упорядоченности по выборке """
+        n = len(lst)
+        profile = {'length': n, 'integers': False, 'numeric': False, 'span': None, 'sortedness': 1.0}
+        if n < 2:
+            return profile
+
+        pairs = range(n - 1) if n <= self.SAMPLE_SIZE else (randrange(n - 1) for _ in range(self.SAMPLE_SIZE))
+        checked = ordered = 0
+        for i in pairs:
+            checked += 1
+            ordered += not lst[i + 1] < lst[i]
+        profile['sortedness'] = ordered / checked
+
+        types = set(map(type, lst))
+        profile['numeric'] = types <= {int, float}
+        if types == {int}:
+            profile['integers'] = True
+            profile['span'] = max(lst) - min(lst) + 1
+
+        return profile
+
+    def distribution(self, profile):
+        """ Отнесение списка к одному из распределений, по которым проводится калибровка """
+        if profile['sortedness'] == 1.0:
+            return 'sorted'
+        if profile['sortedness'] == 0.0:
+            return 'reversed'
+        if profile['sortedness'] >= self.NEARLY_SORTED:
+            return 'nearly_sorted'
+        if CountingSortStrategy.supports(profile):
+            return 'few_unique'
+        return 'random'
 
-    def perform_sort(self, lst):
-        if len(lst) <= 50:
-            self.context.strategy = BubbleSortStrategy()
+    def choose_strategy(self, lst):
+        profile = self.profile(lst)
+        if self.calibration:
+            strategy = self._calibrated_strategy(profile)
+            if strategy:
+                return strategy
+
+        if profile['length'] <= self.INSERTION_THRESHOLD:
+            return InsertionSortStrategy()
+        if profile['length'] >= self.parallel_threshold and profile['numeric']:
+            return ParallelSortStrategy()
+        if CountingSortStrategy.supports(profile):
+            return CountingSortStrategy()
+        if profile['integers'] and profile['sortedness'] < self.NEARLY_SORTED:
+            return RadixSortStrategy()
+        return MergeSortStrategy()
+
+    def _calibrated_strategy(self, profile):
+        """ Первая применимая стратегия из рейтинга для ближайшего (в логарифмической шкале) измеренного размера """
+        ranking = self.calibration['ranking'].get(self.distribution(profile))
+        if not ranking:
+            return None
+        length = max(profile['length'], 1)
+        size = min(ranking, key=lambda item: abs(math.log(int(item)) - math.log(length)))
+        for name in ranking[size]:
+            strategy = self.STRATEGIES.get(name)
+            if strategy is ParallelSortStrategy and profile['length'] < self.parallel_threshold:
+                continue  # пул процессов окупается только на больших списках, между замерами размер не переносится
+            if strategy and strategy.supports(profile):
+                return strategy()
+        return None
+
+    def perform_sort(self, lst, key=None, reverse=False, columns=None):
+        """ Сортировка списка. Ключи вычисляются один раз, и стратегия выбирается по профилю ключей, а не элементов.
+        columns - список ключей (или пар (ключ, reverse)) для сортировки по нескольким столбцам
+        """
+        if columns:
+            self.context.strategy = MergeSortStrategy()
+            return self.context.sort_by_columns(lst, columns)
+        if key is None:
+            self.context.strategy = self.choose_strategy(lst)
+            return self.context.sort(lst, reverse=reverse)
+
+        keys = list(map(key, lst))
+        self.context.strategy = self.choose_strategy(keys)
+        return self.context.sort(lst, keys=keys, reverse=reverse)
+
+    def perform_partial_sort(self, lst, k, largest=False):
+        """ k наименьших (или наибольших) элементов. Куча выгодна при малом k, быстрый выбор - при k, сравнимом с n """
+        if k * 8 < len(lst):
+            self.context.strategy = HeapTopKStrategy(k, largest)
         else:
-            self.context.strategy = InsertionSortStrategy()
+            self.context.strategy = QuickSelectStrategy(k, largest)
         return self.context.sort(lst)
 
+    def perform_external_sort(self, iterable, run_size=1000000, record_format='<q'):
+        """ Сортировка данных, превышающих объём памяти. Принимает любой итерируемый объект и возвращает генератор """
+        self.context.strategy = ExternalMergeSortStrategy(run_size, record_format)
+        return self.context.sort(iterable)
+
+    def perform_batch_sort(self, lists):
+        """ Сортировка множества независимых списков. При наличии numpy - за один векторизованный проход,
+        иначе каждый список сортируется отдельно. В обоих случаях возвращается список списков Python.
+        Общий массив numpy привёл бы элементы всех списков к одному типу (int к float), поэтому векторизованный
+        проход используется, только если во всём пакете элементы одного типа - только int или только float
+        """
+        kinds = set(map(type, chain.from_iterable(lists)))
+        if np is None or len(kinds) > 1 or not kinds <= {int, float}:
+            return [self.perform_sort(lst) for lst in lists]
+        self.context.strategy = NumpyBatchSortStrategy()
+        return [part.tolist() for part in self.context.sort(lists)]
+
 
 if __name__ == '__main__':
     sort_machine = SortMachine()
 
-    not_sorted_lst = [randint(0, 100) for i in range(50)]
+    not_sorted_lst = [randint(0, 100) for i in range(20)]
     sorted_lst = sort_machine.perform_sort(not_sorted_lst)
     print(sorted_lst)
 
     not_sorted_lst = [randint(0, 100) for i in range(100)]
     sorted_lst = sort_machine.perform_sort(not_sorted_lst)
     print(sorted_lst)
+
+    not_sorted_lst = [randint(-10 ** 6, 10 ** 6) for i in range(100)]
+    sorted_lst = sort_machine.perform_sort(not_sorted_lst)
+    print(sorted_lst[:10])
+
+    not_sorted_lst = [randint(0, 100) / 10 for i in range(100)]
+    sorted_lst = sort_machine.perform_sort(not_sorted_lst)
+    print(sorted_lst[:10])
+
+    not_sorted_lst = [randint(-10 ** 9, 10 ** 9) for i in range(SortMachine.PARALLEL_THRESHOLD)]
+    sorted_lst = sort_machine.perform_sort(not_sorted_lst)
+    print(sorted_lst[:10])
+
+    records = [{'name': name, 'age': randint(18, 60)} for name in ['John', 'Paul', 'George', 'Ringo', 'Pete']]
+    print(sort_machine.perform_sort(records, key=lambda record: record['age'], reverse=True))
+    columns = [(lambda record: record['age'], True), lambda record: record['name']]
+    print(sort_machine.perform_sort(records, columns=columns))
+
+    not_sorted_lst = [randint(0, 1000) for i in range(1000)]
+    print(sort_machine.perform_partial_sort(not_sorted_lst, 5))
+    print(sort_machine.perform_partial_sort(not_sorted_lst, 500, largest=True)[:5])
+
+    feed = SortedList(randint(0, 100) for i in range(10))
+    feed.add(50)
+    feed.update(randint(0, 100) for i in range(100))
+    print(feed.smallest(5), feed.largest(5))
+
+    stream = (randint(0, 10 ** 6) for i in range(10000))
+    print(list(islice(sort_machine.perform_external_sort(stream, run_size=1000), 10)))
+
+    batch = [[randint(0, 100) for i in range(randint(1, 10))] for k in range(1000)]
+    sorted_batch = sort_machine.perform_batch_sort(batch)
+    print(sorted_batch[:3])